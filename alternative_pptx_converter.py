@@ -8,9 +8,10 @@ import tempfile
 import logging
 from pathlib import Path
 from typing import Optional, List, Tuple
-import base64
 from openai import OpenAI
 
+from image_analyzer import encode_image_to_base64
+
 logger = logging.getLogger(__name__)
 
 def check_libreoffice_installed() -> bool:
@@ -127,9 +128,10 @@ def analyze_pptx_with_vision(pptx_path: str, api_key: str, model: str = "gpt-4o"
             
             for i, image_path in enumerate(image_files, 1):
                 try:
-                    # 讀取並編碼圖片
-                    with open(image_path, "rb") as image_file:
-                        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+                    # 分塊讀取並編碼圖片，不同時保留原始與編碼後的完整內容
+                    base64_image = encode_image_to_base64(image_path)
+                    if not base64_image:
+                        raise ValueError(f"圖片編碼失敗: {image_path}")
                     
                     response = client.chat.completions.create(
                         model=model,
@@ -6,7 +6,7 @@ from typing import Optional, Dict, Any
 import ssl
 import logging
 from elevenlabs.client import ElevenLabs
-from io import BytesIO
+import random
 import time
 
 
@@ -14,6 +14,13 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 重試等待的基準時間與上限（秒）
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+# 仍值得重試的 4xx 狀態碼（逾時、衝突、速率限制）
+RETRYABLE_CLIENT_STATUS = frozenset({408, 409, 429})
+
 
 class TLSAdapter(HTTPAdapter):
     """自定義 TLS 適配器解決 SSL 協議問題"""
@@ -39,6 +46,38 @@ def create_retry_session():
     return session
 
 
+def get_retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    計算重試前的等待秒數
+    
+    伺服器回傳 Retry-After 時優先採用，否則使用含隨機抖動的指數退避。
+    
+    Args:
+        error: 本次嘗試發生的例外
+        attempt: 目前的嘗試次數（從 0 開始）
+    
+    Returns:
+        等待秒數；請求本身有誤（不應重試的 4xx 錯誤）時返回 None
+    """
+    status_code = getattr(error, "status_code", None)
+    if (
+        isinstance(status_code, int)
+        and 400 <= status_code < 500
+        and status_code not in RETRYABLE_CLIENT_STATUS
+    ):
+        return None
+    
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return min(float(retry_after), RETRY_MAX_DELAY)
+    except (TypeError, ValueError):
+        pass
+    
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return delay + random.uniform(0, RETRY_BASE_DELAY)
+
+
 def transcribe_audio_elevenlabs(
     api_key: str,
     file_path: str,
@@ -65,13 +104,11 @@ def transcribe_audio_elevenlabs(
     
     for attempt in range(max_retries):
         try:
-            # 讀取音訊檔案
+            # 直接傳入檔案物件，由 SDK 串流上傳，不先將整個檔案讀入記憶體
             with open(file_path, 'rb') as audio_file:
-                audio_data = BytesIO(audio_file.read())
-                
                 # 準備 API 參數
                 params = {
-                    "file": audio_data,
+                    "file": audio_file,
                     "model_id": "scribe_v1",
                     "diarize": diarize,
                     "tag_audio_events": True,
@@ -102,9 +139,12 @@ def transcribe_audio_elevenlabs(
                 
         except Exception as e:
             logger.error(f"第 {attempt + 1} 次嘗試失敗：{str(e)}")
+            wait_time = get_retry_delay(e, attempt)
+            if wait_time is None:
+                logger.error("請求無效，不進行重試")
+                return None
             if attempt < max_retries - 1:
-                wait_time = min((attempt + 1) * 5, 30)  # 最長等待 30 秒
-                logger.info(f"{wait_time} 秒後重試...")
+                logger.info(f"{wait_time:.1f} 秒後重試...")
                 time.sleep(wait_time)
             else:
                 logger.error("已達最大重試次數，轉換失敗")
@@ -4,33 +4,145 @@ import logging
 import base64
 from PIL import Image
 import io
+import itertools
+import json
 from openai import OpenAI
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional, Union
 
+try:
+    import orjson
+except ImportError:  # orjson 為選用依賴，未安裝時退回標準庫 json
+    orjson = None
+
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def encode_image_to_base64(image_path: str) -> Optional[str]:
+# Markdown 圖片標記與幻燈片分隔標記
+IMAGE_PATTERN = re.compile(r"!\[(.*?)\]\((.*?)\)")
+SLIDE_PATTERN = re.compile(r"<!-- Slide number: \d+ -->")
+
+# 批次分析時每個請求包含的圖片數量
+DEFAULT_BATCH_SIZE = 4
+
+# 並行呼叫 API 的最大執行緒數
+MAX_WORKERS = 16
+
+# 每張圖片描述的輸出 token 上限
+MAX_COMPLETION_TOKENS_PER_IMAGE = 500
+
+# 推理模型的輸出上限也包含推理 tokens，固定上限容易截斷回應，因此不設定上限
+REASONING_MODEL_PREFIXES = ("o1", "o3", "o4", "gpt-5")
+
+# 圖片分析系統提示詞
+SYSTEM_PROMPT = "你是一個專業的圖片分析助手，專長於醫學和科學圖片的分析。"
+
+# 單圖分析提示詞
+SINGLE_IMAGE_PROMPT = """
+請以繁體中文詳細分析這張圖片，並提供以下資訊：
+
+1. 圖片類型（照片、圖表、示意圖等）
+2. 主要內容描述
+3. 如果是數據圖表，請詳細描述圖表類型和呈現的數據趨勢
+4. 如果有文字內容，請列出重要文字
+5. 對於醫學或科學圖片，請提供專業的解釋
+
+請以結構化的方式回答，使用繁體中文。
+"""
+
+# 多圖批次分析提示詞
+MULTI_IMAGE_PROMPT = """
+請以繁體中文分別詳細分析以下 {count} 張圖片（依上傳順序編號為 0 到 {last}），每張圖片請提供：
+
+1. 圖片類型（照片、圖表、示意圖等）
+2. 主要內容描述
+3. 如果是數據圖表，請詳細描述圖表類型和呈現的數據趨勢
+4. 如果有文字內容，請列出重要文字
+5. 對於醫學或科學圖片，請提供專業的解釋
+
+請務必分析全部 {count} 張圖片，並只回傳以下 JSON 格式：
+{{"results": [{{"index": 0, "description": "第 0 張圖片的分析"}}, {{"index": 1, "description": "第 1 張圖片的分析"}}]}}
+"""
+
+def _loads(text: str):
+    """解析 JSON 字串，優先使用較快的 orjson"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _completion_limit(model: str, count: int = 1) -> Dict:
+    """
+    依模型類型取得輸出 token 上限參數
+    
+    Args:
+        model (str): 模型名稱
+        count (int, optional): 同一請求中的圖片數量. 預設為 1
+        
+    Returns:
+        Dict: 傳給 chat.completions.create 的參數；推理模型為空字典
+    """
+    if model.startswith(REASONING_MODEL_PREFIXES):
+        return {}
+    return {"max_completion_tokens": MAX_COMPLETION_TOKENS_PER_IMAGE * count}
+
+def _split_tokens(tokens: Dict[str, int], count: int) -> List[Dict[str, int]]:
+    """
+    將單一請求的 token 使用量平均分攤到各圖片，餘數由前面的圖片分攤，加總後與原值相同
+    
+    Args:
+        tokens (Dict[str, int]): 請求的 token 使用量
+        count (int): 圖片數量
+        
+    Returns:
+        List[Dict[str, int]]: 各圖片分攤的 token 使用量
+    """
+    return [
+        {
+            name: value // count + (1 if i < value % count else 0)
+            for name, value in tokens.items()
+        }
+        for i in range(count)
+    ]
+
+@lru_cache(maxsize=8)
+def get_openai_client(api_key: str) -> OpenAI:
+    """
+    取得 OpenAI 客戶端，相同 API 金鑰共用同一個連線池（客戶端可跨執行緒使用）
+    
+    Args:
+        api_key (str): OpenAI API Key
+        
+    Returns:
+        OpenAI: OpenAI 客戶端
+    """
+    return OpenAI(api_key=api_key)
+
+def encode_image_to_base64(image_source: Union[str, bytes]) -> Optional[str]:
     """
     將圖片編碼為 base64 字串，以便傳送給 OpenAI API
     
     Args:
-        image_path (str): 圖片檔案路徑
+        image_source (Union[str, bytes]): 圖片檔案路徑，或已在記憶體中的圖片內容
         
     Returns:
         Optional[str]: base64 編碼的圖片字串，如果失敗則返回 None
     """
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        # 記憶體中的圖片內容直接編碼，不需寫入再讀回檔案
+        if isinstance(image_source, bytes):
+            return base64.b64encode(image_source).decode("ascii")
+        
+        with open(image_source, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode("ascii")
     except Exception as e:
         logger.error(f"圖片編碼失敗: {str(e)}")
         return None
 
 def analyze_image(
-    image_path: str, 
+    image_source: Union[str, bytes], 
     api_key: str, 
     model: str = "o4-mini"
 ) -> Dict:
@@ -38,50 +150,37 @@ def analyze_image(
     使用 OpenAI API 解析圖片內容
     
     Args:
-        image_path (str): 圖片檔案路徑
+        image_source (Union[str, bytes]): 圖片檔案路徑，或已在記憶體中的圖片內容
         api_key (str): OpenAI API 金鑰
         model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
         
     Returns:
-        Dict: 解析結果，包含描述和相關資訊
+        Dict: 解析結果，包含描述和 token 使用量
     """
     try:
         # 檢查檔案是否存在
-        if not os.path.exists(image_path):
-            return {"success": False, "error": f"圖片檔案不存在: {image_path}"}
+        if isinstance(image_source, str) and not os.path.exists(image_source):
+            return {"success": False, "error": f"圖片檔案不存在: {image_source}"}
         
         # 編碼圖片
-        base64_image = encode_image_to_base64(image_path)
+        base64_image = encode_image_to_base64(image_source)
         if not base64_image:
             return {"success": False, "error": "圖片編碼失敗"}
         
-        # 初始化 OpenAI 客戶端
-        client = OpenAI(api_key=api_key)
-        
-        # 準備提示詞
-        prompt = """
-        請以繁體中文詳細分析這張圖片，並提供以下資訊：
-        
-        1. 圖片類型（照片、圖表、示意圖等）
-        2. 主要內容描述
-        3. 如果是數據圖表，請詳細描述圖表類型和呈現的數據趨勢
-        4. 如果有文字內容，請列出重要文字
-        5. 對於醫學或科學圖片，請提供專業的解釋
-        
-        請以結構化的方式回答，使用繁體中文。
-        """
+        # 取得共用的 OpenAI 客戶端
+        client = get_openai_client(api_key)
         
         # 呼叫 OpenAI API
         response = client.chat.completions.create(
             model=model,
             messages=[
-                {"role": "system", "content": "你是一個專業的圖片分析助手，專長於醫學和科學圖片的分析。"},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
+                    {"type": "text", "text": SINGLE_IMAGE_PROMPT},
                     {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
                 ]}
             ],
-            max_completion_tokens=500
+            **_completion_limit(model)
         )
         
         # 處理回應
@@ -102,6 +201,120 @@ def analyze_image(
         logger.error(f"圖片解析失敗: {str(e)}")
         return {"success": False, "error": str(e)}
 
+def analyze_images_batch(
+    image_sources: List[Union[str, bytes]],
+    api_key: str,
+    model: str = "o4-mini"
+) -> Dict:
+    """
+    在單一 API 請求中解析多張圖片，共用提示詞以減少請求數與 token 消耗
+    
+    Args:
+        image_sources (List[Union[str, bytes]]): 圖片檔案路徑或圖片內容列表
+        api_key (str): OpenAI API 金鑰
+        model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
+        
+    Returns:
+        Dict: 解析結果，包含依序排列的描述列表和整個請求的 token 使用量；
+            已送出請求但解析失敗時，失敗結果也包含 token 使用量
+    """
+    try:
+        # 編碼所有圖片
+        image_contents = []
+        for index, image_source in enumerate(image_sources):
+            if isinstance(image_source, str) and not os.path.exists(image_source):
+                return {"success": False, "error": f"圖片檔案不存在: {image_source}"}
+            
+            base64_image = encode_image_to_base64(image_source)
+            if not base64_image:
+                return {"success": False, "error": f"第 {index} 張圖片編碼失敗"}
+            
+            image_contents.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+            })
+        
+        # 取得共用的 OpenAI 客戶端
+        client = get_openai_client(api_key)
+        
+        # 準備提示詞：先放編號說明，再依序附上所有圖片
+        count = len(image_sources)
+        prompt = MULTI_IMAGE_PROMPT.format(count=count, last=count - 1)
+        
+        # 呼叫 OpenAI API，要求以 JSON 格式回傳
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": [{"type": "text", "text": prompt}] + image_contents}
+            ],
+            response_format={"type": "json_object"},
+            **_completion_limit(model, count)
+        )
+        
+        # 請求已計費，之後解析失敗也回報使用量
+        tokens_used = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens
+        }
+        
+        # 解析回應並依編號對應回各圖片
+        try:
+            data = _loads(response.choices[0].message.content)
+        except (TypeError, ValueError) as e:
+            return {"success": False, "error": f"批次回應不是有效的 JSON: {e}", "tokens": tokens_used}
+        descriptions = [None] * count
+        for item in data.get("results", []):
+            index = item.get("index")
+            if isinstance(index, int) and 0 <= index < count:
+                descriptions[index] = item.get("description")
+        
+        if not all(descriptions):
+            return {"success": False, "error": "批次回應缺少部分圖片的分析結果", "tokens": tokens_used}
+        
+        return {
+            "success": True,
+            "descriptions": descriptions,
+            "tokens": tokens_used
+        }
+    
+    except Exception as e:
+        logger.error(f"批次圖片解析失敗: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def analyze_images_concurrently(
+    image_paths: List[str],
+    api_key: str,
+    model: str = "o4-mini",
+    max_workers: int = MAX_WORKERS
+) -> Dict[str, Dict]:
+    """
+    使用執行緒池並行解析多張圖片
+    
+    Args:
+        image_paths (List[str]): 圖片檔案路徑列表
+        api_key (str): OpenAI API 金鑰
+        model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
+        max_workers (int, optional): 最大執行緒數. 預設為 MAX_WORKERS
+        
+    Returns:
+        Dict[str, Dict]: 圖片路徑對應的解析結果
+    """
+    results = {}
+    if not image_paths:
+        return results
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(image_paths))) as executor:
+        future_to_path = {
+            executor.submit(analyze_image, img_path, api_key, model): img_path
+            for img_path in image_paths
+        }
+        for future in as_completed(future_to_path):
+            results[future_to_path[future]] = future.result()
+    
+    return results
+
 def enhance_markdown_with_image_analysis(
     markdown_text: str, 
     base_dir: str, 
@@ -128,8 +341,20 @@ def enhance_markdown_with_image_analysis(
         "total_tokens": 0
     }
     
-    # 查找所有圖片標記
-    img_pattern = r"!\[(.*?)\]\((.*?)\)"
+    # 先找出所有需要分析的圖片，再並行呼叫 API
+    pending_paths = []
+    for match in IMAGE_PATTERN.finditer(markdown_text):
+        # 跳過已經有詳細描述的圖片
+        if len(match.group(1)) > 20:  # 假設詳細描述至少有20個字元
+            continue
+        full_img_path = os.path.join(base_dir, match.group(2))
+        if full_img_path not in pending_paths and os.path.exists(full_img_path):
+            pending_paths.append(full_img_path)
+    
+    analyses = analyze_images_concurrently(pending_paths, api_key, model)
+    for analysis in analyses.values():
+        if analysis["success"]:
+            stats["total_tokens"] += analysis["tokens"]["total_tokens"]
     
     def replace_image(match):
         alt_text = match.group(1)
@@ -144,20 +369,19 @@ def enhance_markdown_with_image_analysis(
         full_img_path = os.path.join(base_dir, img_path)
         
         # 檢查文件是否存在
-        if not os.path.exists(full_img_path):
+        if full_img_path not in analyses:
             logger.warning(f"圖片不存在: {full_img_path}")
             stats["images_failed"] += 1
             return match.group(0)
         
-        # 分析圖片
-        analysis = analyze_image(full_img_path, api_key, model)
+        # 取得並行分析的結果
+        analysis = analyses[full_img_path]
         
         if analysis["success"]:
             stats["images_analyzed"] += 1
-            stats["total_tokens"] += analysis["tokens"]["total_tokens"]
             
             # 提取簡短描述作為 alt 文本
-            short_desc = analysis["description"].split("\n")[0]
+            short_desc = analysis["description"].partition("\n")[0]
             if len(short_desc) > 100:
                 short_desc = short_desc[:97] + "..."
                 
@@ -168,109 +392,193 @@ def enhance_markdown_with_image_analysis(
             stats["images_failed"] += 1
             return match.group(0)
     
-    # 替換圖片標記
-    enhanced_markdown = re.sub(img_pattern, replace_image, markdown_text)
+    # 替換所有圖片標記
+    enhanced_markdown = IMAGE_PATTERN.sub(replace_image, markdown_text)
     
     return enhanced_markdown, stats
 
 def enhance_slides(
     markdown_text: str,
     api_key: str,
-    model: str = "o4-mini"
+    model: str = "o4-mini",
+    base_dir: str = "."
 ) -> Dict:
     """
     增強幻燈片內容，識別幻燈片中的圖片並添加描述
     
+    整份文件只進行一次圖片增強，幻燈片分隔標記保留在原位置，
+    處理完成後再依出現順序重新編號。
+    
     Args:
         markdown_text (str): 幻燈片的 Markdown 文本
         api_key (str): OpenAI API 金鑰
         model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
+        base_dir (str, optional): 圖片基礎目錄路徑. 預設為當前目錄
         
     Returns:
         Dict: 增強結果，包含增強後的文本和統計資訊
     """
-    # 將幻燈片文本按幻燈片分隔
-    slide_pattern = r"<!-- Slide number: \d+ -->"
-    slides = re.split(slide_pattern, markdown_text)
+    # 記錄幻燈片分隔標記的位置，沒有分隔符時整個文本視為一個幻燈片
+    slide_count = sum(1 for _ in SLIDE_PATTERN.finditer(markdown_text)) + 1
+    logger.info(f"處理幻燈片，共 {slide_count} 個區塊")
     
-    # 如果沒有符合的分隔符，則將整個文本作為一個幻燈片處理
-    if len(slides) == 1 and slides[0] == markdown_text:
-        slides = [markdown_text]
+    # 對整份文件進行一次圖片增強
+    enhanced_text, image_stats = enhance_markdown_with_image_analysis(
+        markdown_text, base_dir, api_key, model
+    )
     
-    # 初始化統計資訊
+    # 依出現順序重新編號幻燈片
+    slide_numbers = itertools.count(1)
+    enhanced_text = SLIDE_PATTERN.sub(
+        lambda match: f"<!-- Slide number: {next(slide_numbers)} -->",
+        enhanced_text
+    )
+    
+    # 統計資訊
     stats = {
-        "slides_processed": len(slides),
-        "images_processed": 0,
-        "images_analyzed": 0,
-        "images_failed": 0,
-        "total_tokens": 0
+        "slides_processed": slide_count,
+        "images_processed": image_stats["images_processed"],
+        "images_analyzed": image_stats["images_analyzed"],
+        "images_failed": image_stats["images_failed"],
+        "total_tokens": image_stats["total_tokens"]
     }
     
-    # 處理每個幻燈片
-    enhanced_slides = []
-    for i, slide in enumerate(slides):
-        if not slide.strip():
-            enhanced_slides.append(slide)
-            continue
-            
-        # 識別幻燈片中的圖片
-        logger.info(f"處理幻燈片 {i+1}/{len(slides)}")
-        
-        # 使用當前目錄作為基礎目錄
-        base_dir = "."
-        enhanced_slide, slide_stats = enhance_markdown_with_image_analysis(
-            slide, base_dir, api_key, model
-        )
-        
-        # 更新統計資訊
-        stats["images_processed"] += slide_stats["images_processed"]
-        stats["images_analyzed"] += slide_stats["images_analyzed"]
-        stats["images_failed"] += slide_stats["images_failed"]
-        stats["total_tokens"] += slide_stats["total_tokens"]
-        
-        # 添加幻燈片編號
-        if i > 0:  # 第一個可能是空白或前言
-            enhanced_slide = f"<!-- Slide number: {i} -->\n{enhanced_slide}"
-            
-        enhanced_slides.append(enhanced_slide)
-    
-    # 合併增強後的幻燈片
-    enhanced_text = "".join(enhanced_slides)
-    
     return {
         "enhanced_text": enhanced_text,
         "stats": stats
     }
 
-def batch_process_images(
-    image_paths: List[str], 
-    api_key: str, 
+def analyze_image_group(
+    image_sources: List[Union[str, bytes]],
+    api_key: str,
     model: str = "o4-mini"
-) -> Dict:
+) -> List[Dict]:
     """
-    批次處理多張圖片
+    分析一組圖片：多張時先以單一請求批次分析，失敗則退回單張模式
+    
+    批次成功時，整個請求的 token 使用量平均分攤到各圖片（餘數由前面的圖片分攤），
+    每張圖片的用量可單獨快取，加總後即為實際用量。批次解析失敗而退回單張模式時，
+    失敗請求的用量同樣分攤加到各圖片的結果中。
     
     Args:
-        image_paths (List[str]): 圖片路徑列表
+        image_sources (List[Union[str, bytes]]): 同一請求中的圖片檔案路徑或圖片內容列表
         api_key (str): OpenAI API 金鑰
         model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
         
     Returns:
-        Dict: 批次處理結果
+        List[Dict]: 依輸入順序排列的解析結果，格式與 analyze_image 相同
+    """
+    if len(image_sources) > 1:
+        logger.info(f"批次處理 {len(image_sources)} 張圖片")
+        batch_result = analyze_images_batch(image_sources, api_key, model)
+        
+        if batch_result["success"]:
+            return [
+                {
+                    "success": True,
+                    "description": description,
+                    "tokens": tokens
+                }
+                for description, tokens in zip(
+                    batch_result["descriptions"],
+                    _split_tokens(batch_result["tokens"], len(image_sources))
+                )
+            ]
+        
+        # 批次解析失敗時退回單張模式
+        logger.warning(
+            f"批次分析失敗，改用單張模式: {batch_result.get('error', '未知錯誤')}"
+        )
+        failed_tokens = batch_result.get("tokens")
+    else:
+        failed_tokens = None
+    
+    results = []
+    for i, image_source in enumerate(image_sources, 1):
+        logger.info(f"處理圖片 {i}/{len(image_sources)}")
+        results.append(analyze_image(image_source, api_key, model))
+    
+    # 失敗的批次請求已計費，將其用量分攤到各圖片的結果中
+    if failed_tokens:
+        for result, share in zip(results, _split_tokens(failed_tokens, len(results))):
+            tokens = result.setdefault(
+                "tokens",
+                {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            )
+            for name, value in share.items():
+                tokens[name] = tokens.get(name, 0) + value
+    return results
+
+def _process_image_chunk(
+    chunk: List[str],
+    api_key: str,
+    model: str
+) -> Tuple[Dict[str, str], int]:
+    """
+    處理一組圖片，將解析結果轉為描述文字
+    
+    Args:
+        chunk (List[str]): 同一請求中的圖片路徑列表
+        api_key (str): OpenAI API 金鑰
+        model (str): 使用的模型名稱
+        
+    Returns:
+        Tuple[Dict[str, str], int]: 圖片路徑對應的描述和使用的 tokens
     """
     results = {}
     total_tokens = 0
     
-    for img_path in image_paths:
-        logger.info(f"處理圖片: {img_path}")
-        result = analyze_image(img_path, api_key, model)
-        
+    for img_path, result in zip(chunk, analyze_image_group(chunk, api_key, model)):
         if result["success"]:
             results[img_path] = result["description"]
             total_tokens += result["tokens"]["total_tokens"]
         else:
             results[img_path] = f"分析失敗: {result.get('error', '未知錯誤')}"
     
+    return results, total_tokens
+
+def batch_process_images(
+    image_paths: List[str], 
+    api_key: str, 
+    model: str = "o4-mini",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_workers: int = MAX_WORKERS
+) -> Dict:
+    """
+    批次處理多張圖片，每個請求最多包含 batch_size 張圖片，各請求並行送出
+    
+    Args:
+        image_paths (List[str]): 圖片路徑列表
+        api_key (str): OpenAI API 金鑰
+        model (str, optional): 使用的模型名稱. 預設為 "o4-mini"
+        batch_size (int, optional): 每個請求的圖片數量. 預設為 DEFAULT_BATCH_SIZE
+        max_workers (int, optional): 最大執行緒數. 預設為 MAX_WORKERS
+        
+    Returns:
+        Dict: 批次處理結果
+    """
+    # 保留輸入順序
+    results = dict.fromkeys(image_paths)
+    total_tokens = 0
+    
+    batch_size = max(1, batch_size)
+    chunks = [
+        image_paths[start:start + batch_size]
+        for start in range(0, len(image_paths), batch_size)
+    ]
+    
+    if chunks:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            futures = [
+                executor.submit(_process_image_chunk, chunk, api_key, model)
+                for chunk in chunks
+            ]
+            # 只在主執行緒中合併結果，不需要額外加鎖
+            for future in as_completed(futures):
+                chunk_results, chunk_tokens = future.result()
+                results.update(chunk_results)
+                total_tokens += chunk_tokens
+    
     return {
         "results": results,
         "total_tokens": total_tokens,
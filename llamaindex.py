@@ -1,18 +1,79 @@
-@mcp.tool()
-def search_knowledge_base(query: str) -> str:
-    """使用LlamaIndex搜索知識庫，獲取相關信息。
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union
+
+import streamlit as st
+from llama_index.indices.managed.llama_cloud import LlamaCloudIndex
+from llama_parse import LlamaParse
+from mcp.server.fastmcp import FastMCP
+from openai import OpenAI
+from PIL import Image
+
+try:
+    import orjson
+except ImportError:  # orjson 為選用依賴，未安裝時退回標準庫 json
+    orjson = None
+
+
+def _dumps(obj, indent: bool = False) -> str:
+    """將物件序列化為 JSON 字串，優先使用較快的 orjson（保留非 ASCII 字元）"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MCP 服務器，提供下方以 @mcp.tool() 註冊的工具
+mcp = FastMCP("llama-image-analysis")
+
+# 以背景事件迴圈並行分析上傳的文件；設定 ASYNC_ANALYSIS=0 可退回逐一同步處理
+ASYNC_ANALYSIS = os.environ.get("ASYNC_ANALYSIS", "1") != "0"
+
+# 同時分析的文件數上限，避免大量上傳時一次送出過多 API 請求
+MAX_CONCURRENT_ANALYSES = int(os.environ.get("MAX_CONCURRENT_ANALYSES", "4"))
+
+# 背景事件迴圈專用的執行緒池，限制實際並行執行的分析工作數
+_analysis_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_ANALYSES)
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+# 專注於OCR的提示詞
+OCR_PROMPT = """請提取此圖像中的所有文字。只返回圖像中的文字內容，保持原始格式和段落結構。不要添加任何解釋或描述。"""
+
+# 專注於結構化數據提取的提示詞模板
+STRUCTURED_DATA_PROMPT = """分析這張圖像並提取符合以下JSON schema的結構化數據:
+        
+        {schema}
+        
+        請確保返回的內容是有效的JSON格式，並且符合上述schema。"""
+
+def _search_knowledge_base_impl(query: str) -> dict:
+    """使用LlamaIndex搜索知識庫。
     
     Args:
         query: 搜索查詢
     
     Returns:
-        搜索結果的文本
+        {"result": 搜索結果文本} 或 {"error": 錯誤訊息}
     """
     try:
         llama_cloud_api_key = os.environ.get("LLAMA_CLOUD_API_KEY")
         
         if not llama_cloud_api_key:
-            return json.dumps({"error": "請提供Llama Cloud API密鑰"})
+            return {"error": "請提供Llama Cloud API密鑰"}
             
         index = LlamaCloudIndex(
             name="image-analysis-knowledge-base",
@@ -21,33 +82,44 @@ def search_knowledge_base(query: str) -> str:
         )
         
         response = index.as_query_engine().query(query)
-        return str(response)
+        return {"result": str(response)}
     except Exception as e:
         error_msg = f"搜索知識庫錯誤: {e}"
         logger.error(error_msg)
-        return json.dumps({"error": error_msg})
+        return {"error": error_msg}
 
 @mcp.tool()
-def extract_text_from_image(image_base64: str) -> str:
+def search_knowledge_base(query: str) -> str:
+    """使用LlamaIndex搜索知識庫，獲取相關信息。
+    
+    Args:
+        query: 搜索查詢
+    
+    Returns:
+        搜索結果的文本
+    """
+    result = _search_knowledge_base_impl(query)
+    if "error" in result:
+        return _dumps(result)
+    return result["result"]
+
+def _extract_text_from_image_impl(image_base64: str) -> dict:
     """從圖像中提取純文字內容。
     
     Args:
         image_base64: 圖像的base64編碼字符串
     
     Returns:
-        提取的文字內容
+        {"text": 提取的文字} 或 {"error": 錯誤訊息}
     """
     openai_api_key = os.environ.get("OPENAI_API_KEY", "")
     
     if not openai_api_key:
-        return json.dumps({"error": "請提供OpenAI API密鑰"})
+        return {"error": "請提供OpenAI API密鑰"}
         
     try:
         client = OpenAI(api_key=openai_api_key)
         
-        # 專注於OCR的提示詞
-        prompt = """請提取此圖像中的所有文字。只返回圖像中的文字內容，保持原始格式和段落結構。不要添加任何解釋或描述。"""
-        
         # 調用OpenAI API
         response = client.chat.completions.create(
             model="gpt-4-vision-preview",
@@ -55,7 +127,7 @@ def extract_text_from_image(image_base64: str) -> str:
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": prompt},
+                        {"type": "text", "text": OCR_PROMPT},
                         {
                             "type": "image_url",
                             "image_url": {
@@ -68,16 +140,30 @@ def extract_text_from_image(image_base64: str) -> str:
             max_completion_tokens=1000
         )
         
-        return response.choices[0].message.content
+        return {"text": response.choices[0].message.content}
             
     except Exception as e:
         error_type = "文字提取錯誤"
         error_msg = f"{error_type}: {e}"
         logger.error(error_msg)
-        return json.dumps({"error": error_msg})
+        return {"error": error_msg}
 
 @mcp.tool()
-def image_to_structured_data(image_base64: str, schema: str) -> str:
+def extract_text_from_image(image_base64: str) -> str:
+    """從圖像中提取純文字內容。
+    
+    Args:
+        image_base64: 圖像的base64編碼字符串
+    
+    Returns:
+        提取的文字內容
+    """
+    result = _extract_text_from_image_impl(image_base64)
+    if "error" in result:
+        return _dumps(result)
+    return result["text"]
+
+def _image_to_structured_data_impl(image_base64: str, schema: str) -> dict:
     """從圖像提取結構化數據，基於提供的schema。
     
     Args:
@@ -85,22 +171,17 @@ def image_to_structured_data(image_base64: str, schema: str) -> str:
         schema: 描述要提取的結構化數據格式的JSON schema
     
     Returns:
-        符合schema的結構化JSON數據
+        解析後的結構化數據；模型回應不是有效JSON時為 {"result": 原始回應}，失敗時為 {"error": 錯誤訊息}
     """
     openai_api_key = os.environ.get("OPENAI_API_KEY", "")
     
     if not openai_api_key:
-        return json.dumps({"error": "請提供OpenAI API密鑰"})
+        return {"error": "請提供OpenAI API密鑰"}
         
     try:
         client = OpenAI(api_key=openai_api_key)
         
-        # 專注於結構化數據提取的提示詞
-        prompt = f"""分析這張圖像並提取符合以下JSON schema的結構化數據:
-        
-        {schema}
-        
-        請確保返回的內容是有效的JSON格式，並且符合上述schema。"""
+        prompt = STRUCTURED_DATA_PROMPT.format(schema=schema)
         
         # 調用OpenAI API
         response = client.chat.completions.create(
@@ -122,47 +203,55 @@ def image_to_structured_data(image_base64: str, schema: str) -> str:
             max_completion_tokens=1500
         )
         
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        # 嘗試解析JSON
+        try:
+            return json.loads(content)
+        except (TypeError, ValueError):
+            return {"result": content}
             
     except Exception as e:
         error_type = "結構化數據提取錯誤"
         error_msg = f"{error_type}: {e}"
         logger.error(error_msg)
-        return json.dumps({"error": error_msg})
+        return {"error": error_msg}
 
 @mcp.tool()
-def analyze_document_image_with_llamaparse(image_base64: str) -> str:
+def image_to_structured_data(image_base64: str, schema: str) -> str:
+    """從圖像提取結構化數據，基於提供的schema。
+    
+    Args:
+        image_base64: 圖像的base64編碼字符串
+        schema: 描述要提取的結構化數據格式的JSON schema
+    
+    Returns:
+        符合schema的結構化JSON數據
+    """
+    return _dumps(_image_to_structured_data_impl(image_base64, schema))
+
+def _analyze_document_image_with_llamaparse_impl(image_base64: str) -> Union[list, dict]:
     """使用LlamaParse分析文檔圖像，提取結構化信息。
     
     Args:
         image_base64: 文檔圖像的base64編碼字符串
     
     Returns:
-        分析結果的文本
+        每個文檔的內容與元數據列表，失敗時為 {"error": 錯誤訊息}
     """
     try:
-        # 首先將base64圖像保存為臨時文件
-        import tempfile
-        import base64
-        
         llama_cloud_api_key = os.environ.get("LLAMA_CLOUD_API_KEY")
         if not llama_cloud_api_key:
-            return json.dumps({"error": "請提供Llama Cloud API密鑰"})
-        
-        # 創建臨時文件
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(base64.b64decode(image_base64))
+            return {"error": "請提供Llama Cloud API密鑰"}
         
-        # 使用LlamaParse分析
+        # 使用LlamaParse分析，直接傳入解碼後的圖像位元組，不經過臨時文件
         parser = LlamaParse(
             api_key=llama_cloud_api_key
         )
         
-        documents = parser.load_data(temp_file_path)
-        
-        # 刪除臨時文件
-        os.unlink(temp_file_path)
+        documents = parser.load_data(
+            base64.b64decode(image_base64),
+            extra_info={"file_name": "document_image.png"}
+        )
         
         # 返回結構化分析結果
         results = []
@@ -172,11 +261,126 @@ def analyze_document_image_with_llamaparse(image_base64: str) -> str:
                 "metadata": doc.metadata
             })
             
-        return json.dumps(results, ensure_ascii=False)
+        return results
     except Exception as e:
         error_msg = f"LlamaParse分析文檔圖像錯誤: {e}"
         logger.error(error_msg)
-        return json.dumps({"error": error_msg})
+        return {"error": error_msg}
+
+@mcp.tool()
+def analyze_document_image_with_llamaparse(image_base64: str) -> str:
+    """使用LlamaParse分析文檔圖像，提取結構化信息。
+    
+    Args:
+        image_base64: 文檔圖像的base64編碼字符串
+    
+    Returns:
+        分析結果的文本
+    """
+    return _dumps(_analyze_document_image_with_llamaparse_impl(image_base64))
+
+def _analyze_uploaded_file(file_name: str, file_data: bytes, analysis_mode: str, options: dict) -> dict:
+    """依分析模式處理單一上傳文件，可在背景執行緒中執行（不呼叫任何 Streamlit 元件）。
+    
+    Args:
+        file_name: 文件名稱
+        file_data: 文件內容
+        analysis_mode: 分析模式
+        options: 側邊欄設定（custom_prompt、schema、query）
+    
+    Returns:
+        該文件的分析結果
+    """
+    # 處理HEIC格式圖像
+    if file_name.lower().endswith((".heic", ".heif")):
+        try:
+            image = Image.open(io.BytesIO(file_data))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG")
+            file_data = buffer.getvalue()
+        except Exception as e:
+            return {"error": f"轉換HEIC圖像錯誤: {e}"}
+    
+    # 將文件數據轉換為base64
+    file_base64 = base64.b64encode(file_data).decode('utf-8')
+    
+    # 根據分析模式調用不同的工具
+    try:
+        if analysis_mode == "基本分析":
+            tool_result = extract_image_keywords(file_base64, options["custom_prompt"])
+            # 嘗試解析JSON
+            try:
+                return json.loads(tool_result)
+            except:
+                return {"result": tool_result}
+                
+        elif analysis_mode == "文字提取":
+            return _extract_text_from_image_impl(file_base64)
+            
+        elif analysis_mode == "結構化數據":
+            return _image_to_structured_data_impl(file_base64, options["schema"])
+                
+        elif analysis_mode == "文檔分析":
+            # 如果是PDF等文檔格式，保存為臨時文件
+            if file_name.lower().endswith((".pdf", ".docx", ".txt")):
+                with tempfile.NamedTemporaryFile(suffix=f".{file_name.split('.')[-1]}", delete=False) as temp_file:
+                    temp_file_path = temp_file.name
+                    temp_file.write(file_data)
+                tool_result = analyze_document_with_llama_parse(temp_file_path)
+                os.unlink(temp_file_path)  # 刪除臨時文件
+            else:
+                # 處理圖像文檔，直接取得Python物件，不經過JSON序列化
+                return _analyze_document_image_with_llamaparse_impl(file_base64)
+            
+            # 嘗試解析JSON
+            try:
+                return json.loads(tool_result)
+            except:
+                return {"result": tool_result}
+                
+        elif analysis_mode == "知識庫搜索":
+            # 首先提取圖像文字，然後基於文字內容搜索
+            text_result = _extract_text_from_image_impl(file_base64)
+            if "error" in text_result:
+                return text_result
+            extracted_text = text_result["text"]
+            
+            # 生成搜索查詢
+            search_query = options["query"] if options["query"] else f"關於以下內容的重要信息: {extracted_text[:200]}"
+            
+            # 執行搜索
+            search_result = _search_knowledge_base_impl(search_query)
+            return {
+                "extracted_text": extracted_text,
+                "search_query": search_query,
+                "search_result": search_result.get("result", search_result.get("error"))
+            }
+        
+        return {"error": f"未知的分析模式: {analysis_mode}"}
+    
+    except Exception as e:
+        error_type = "處理錯誤"
+        error_msg = f"{error_type}: {e}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+async def _analyze_uploaded_file_async(file_name: str, file_data: bytes, analysis_mode: str, options: dict) -> dict:
+    """在有上限的執行緒池中執行同步的文件分析，讓多個文件的網路等待互相重疊，超過上限的文件排隊等候。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _analysis_executor, _analyze_uploaded_file, file_name, file_data, analysis_mode, options
+    )
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """取得在背景執行緒中持續運行的事件迴圈（與MCP服務器相同的背景執行緒模式）。"""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            loop_thread = threading.Thread(target=_background_loop.run_forever)
+            loop_thread.daemon = True
+            loop_thread.start()
+    return _background_loop
 
 # 主要Streamlit應用界面
 def main():
@@ -282,100 +486,47 @@ def main():
             not llama_cloud_api_key and analysis_mode in ["文檔分析", "知識庫搜索"])
         
         if st.button("開始分析", disabled=analyze_button_disabled):
-            with st.spinner("分析中..."):
-                results = {}
-                
-                for i, uploaded_file in enumerate(uploaded_files):
-                    file_name = uploaded_file.name
-                    st.write(f"正在處理 {file_name}...")
-                    
-                    # 讀取上傳的文件
-                    file_data = uploaded_file.read()
-                    
-                    # 處理HEIC格式圖像
-                    if file_name.lower().endswith((".heic", ".heif")):
-                        try:
-                            image = Image.open(io.BytesIO(file_data))
-                            buffer = io.BytesIO()
-                            image.save(buffer, format="JPEG")
-                            file_data = buffer.getvalue()
-                        except Exception as e:
-                            results[file_name] = {"error": f"轉換HEIC圖像錯誤: {e}"}
-                            continue
-                    
-                    # 將文件數據轉換為base64
-                    import base64
-                    file_base64 = base64.b64encode(file_data).decode('utf-8')
-                    
-                    # 根據分析模式調用不同的工具
-                    try:
-                        if analysis_mode == "基本分析":
-                            tool_result = extract_image_keywords(
-                                file_base64, 
-                                custom_prompt if 'custom_prompt' in locals() else None
-                            )
-                            # 嘗試解析JSON
-                            try:
-                                results[file_name] = json.loads(tool_result)
-                            except:
-                                results[file_name] = {"result": tool_result}
-                                
-                        elif analysis_mode == "文字提取":
-                            tool_result = extract_text_from_image(file_base64)
-                            results[file_name] = {"text": tool_result}
-                            
-                        elif analysis_mode == "結構化數據":
-                            tool_result = image_to_structured_data(
-                                file_base64, 
-                                schema_input if 'schema_input' in locals() else default_schema
-                            )
-                            # 嘗試解析JSON
-                            try:
-                                results[file_name] = json.loads(tool_result)
-                            except:
-                                results[file_name] = {"result": tool_result}
-                                
-                        elif analysis_mode == "文檔分析":
-                            # 如果是PDF等文檔格式，保存為臨時文件
-                            if file_name.lower().endswith((".pdf", ".docx", ".txt")):
-                                with tempfile.NamedTemporaryFile(suffix=f".{file_name.split('.')[-1]}", delete=False) as temp_file:
-                                    temp_file_path = temp_file.name
-                                    temp_file.write(file_data)
-                                tool_result = analyze_document_with_llama_parse(temp_file_path)
-                                os.unlink(temp_file_path)  # 刪除臨時文件
-                            else:
-                                # 處理圖像文檔
-                                tool_result = analyze_document_image_with_llamaparse(file_base64)
-                            
-                            # 嘗試解析JSON
-                            try:
-                                results[file_name] = json.loads(tool_result)
-                            except:
-                                results[file_name] = {"result": tool_result}
-                                
-                        elif analysis_mode == "知識庫搜索":
-                            # 首先提取圖像文字，然後基於文字內容搜索
-                            extracted_text = extract_text_from_image(file_base64)
-                            
-                            # 生成搜索查詢
-                            search_query = query_input if query_input else f"關於以下內容的重要信息: {extracted_text[:200]}"
-                            
-                            # 執行搜索
-                            tool_result = search_knowledge_base(search_query)
-                            results[file_name] = {
-                                "extracted_text": extracted_text,
-                                "search_query": search_query,
-                                "search_result": tool_result
-                            }
-                    
-                    except Exception as e:
-                        error_type = "處理錯誤"
-                        error_msg = f"{error_type}: {e}"
-                        logger.error(error_msg)
-                        results[file_name] = {"error": error_msg}
-                
-                # 顯示結果
-                st.session_state.results = results
+            # 在主執行緒讀取上傳的文件，分析工作交給背景執行
+            files = [(uploaded_file.name, uploaded_file.read()) for uploaded_file in uploaded_files]
+            options = {
+                "custom_prompt": custom_prompt if 'custom_prompt' in locals() else None,
+                "schema": schema_input if 'schema_input' in locals() else None,
+                "query": query_input if 'query_input' in locals() else "",
+            }
+            
+            total = len(files)
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            results = {}
+            
+            if ASYNC_ANALYSIS:
+                # 所有文件送往背景事件迴圈，最多 MAX_CONCURRENT_ANALYSES 個同時執行，每完成一個就更新進度
+                loop = _get_background_loop()
+                future_to_name = {
+                    asyncio.run_coroutine_threadsafe(
+                        _analyze_uploaded_file_async(file_name, file_data, analysis_mode, options),
+                        loop
+                    ): file_name
+                    for file_name, file_data in files
+                }
+                for done, future in enumerate(as_completed(future_to_name), start=1):
+                    file_name = future_to_name[future]
+                    results[file_name] = future.result()
+                    status_text.write(f"已完成 {file_name} ({done}/{total})")
+                    progress_bar.progress(done / total)
+            else:
+                with st.spinner("分析中..."):
+                    for done, (file_name, file_data) in enumerate(files, start=1):
+                        status_text.write(f"正在處理 {file_name}...")
+                        results[file_name] = _analyze_uploaded_file(
+                            file_name, file_data, analysis_mode, options
+                        )
+                        progress_bar.progress(done / total)
+            
+            # 依上傳順序保存結果
+            st.session_state.results = {
+                file_name: results[file_name] for file_name, _ in files
+            }
     
     # 顯示結果
     with result_col:
@@ -383,7 +534,7 @@ def main():
         
         if "results" in st.session_state and st.session_state.results:
             # 創建下載按鈕
-            json_results = json.dumps(st.session_state.results, ensure_ascii=False, indent=2)
+            json_results = _dumps(st.session_state.results, indent=True)
             st.download_button(
                 label="下載完整結果 (JSON)",
                 data=json_results,
@@ -465,7 +616,7 @@ def main():
                                 for meta_key, meta_value in doc_result.get("metadata", {}).items():
                                     st.write(f"- {meta_key}: {meta_value}")
                         else:
-                            st.write(result.get("result", json.dumps(result, ensure_ascii=False)))
+                            st.write(result.get("result", _dumps(result)))
                     
                     elif analysis_mode == "知識庫搜索":
                         st.write("**提取的文字:**")
@@ -479,7 +630,7 @@ def main():
                     
                     # 顯示原始結果
                     with st.expander("查看原始數據"):
-                        st.code(json.dumps(result, ensure_ascii=False, indent=2))
+                        st.code(_dumps(result, indent=True))
         else:
             st.info("上傳內容並點擊分析按鈕以查看結果")
 
@@ -507,9 +658,6 @@ def main():
 
 # 啟動MCP服務器和Streamlit應用
 if __name__ == "__main__":
-    import threading
-    import asyncio
-    
     # 啟動MCP服務器
     def run_mcp_server():
         asyncio.run(mcp.run_sse_async())
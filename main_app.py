@@ -1,16 +1,21 @@
 # 標準庫導入
 import os
+import re
 import logging
 import tempfile
 import time
-import base64
+import hashlib
+import shutil
+import subprocess
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 第三方庫導入
 import streamlit as st
 from dotenv import load_dotenv
 from openai import OpenAI
-import google.generativeai as genai
-from pydub import AudioSegment
 
 # 本地模組導入
 from whisper_stt import get_model_description, transcribe_audio_whisper
@@ -22,7 +27,8 @@ from markitdown_utils import (
 )
 # 導入圖像分析功能
 from image_analyzer import (
-    analyze_image,
+    DEFAULT_BATCH_SIZE,
+    analyze_image_group,
     enhance_slides
 )
 
@@ -33,6 +39,102 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 並行轉錄音訊分段的最大執行緒數，可用環境變數 S2T_CONCURRENCY 調整
+MAX_TRANSCRIPTION_WORKERS = int(os.getenv("S2T_CONCURRENCY", "8"))
+
+# OpenAI 客戶端的最大重試次數（由 SDK 處理指數退避與 Retry-After）
+MAX_RETRIES = 3
+
+# OpenAI 轉錄 API 的上傳檔案大小上限（25 MB），保留少量餘裕給 multipart 表頭
+OPENAI_MAX_UPLOAD_BYTES = 25 * 1000 * 1000 - 500 * 1000
+
+# 並行分析上傳圖片的最大執行緒數
+MAX_IMAGE_ANALYSIS_WORKERS = 8
+
+# 進度條更新的最小間隔（進度比例）
+PROGRESS_UPDATE_STEP = 0.05
+
+# 純文字輸出時移除的 Markdown 標記：標題符號、粗體/斜體星號、分隔線
+MARKDOWN_SYMBOL_PATTERN = re.compile(r"#+|\*+|-{3}")
+
+# Gemini 回應中的優化文字與摘要區段
+GEMINI_RESPONSE_PATTERN = re.compile(r"\[優化後文字\](.*?)\[重點摘要\](.*)", re.DOTALL)
+GEMINI_LEGACY_RESPONSE_PATTERN = re.compile(r"(.*?)重點摘要：(.*)", re.DOTALL)
+
+# 分段轉錄結果的磁碟快取目錄，可用環境變數 S2T_CACHE_DIR 調整；目錄僅限目前使用者存取
+TRANSCRIPTION_CACHE_DIR = os.getenv(
+    "S2T_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "speech2text_cache")
+)
+
+# 是否將轉錄結果保存在磁碟快取中；設定 S2T_TRANSCRIPTION_CACHE=0 可停用，不在磁碟留下逐字稿
+TRANSCRIPTION_CACHE_ENABLED = os.getenv("S2T_TRANSCRIPTION_CACHE", "1") != "0"
+
+# 磁碟快取的保存期限（秒）與總大小上限（位元組），寫入時清理超出的檔案
+TRANSCRIPTION_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+TRANSCRIPTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# 同一時間只由一個執行緒清理磁碟快取
+TRANSCRIPTION_CACHE_PRUNE_LOCK = threading.Lock()
+
+# 分塊讀取音訊檔案的區塊大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 背景轉錄進度的輪詢間隔（秒）
+TRANSCRIPTION_POLL_INTERVAL = 2
+
+# 轉錄結果快取的最大筆數
+TRANSCRIPTION_CACHE_MAX_ENTRIES = 16
+
+# Gemini 優化結果快取的最大筆數
+GEMINI_CACHE_MAX_ENTRIES = 32
+
+# OpenAI 優化結果快取的最大筆數
+OPENAI_REFINE_CACHE_MAX_ENTRIES = 32
+
+# 文件轉換與圖片分析結果快取的最大筆數
+MARKDOWN_CACHE_MAX_ENTRIES = 16
+IMAGE_ANALYSIS_CACHE_MAX_ENTRIES = 128
+
+# 雲端轉錄前壓縮音訊的參數：超過此平均位元率（bps）的檔案會重新編碼為低位元率單聲道 MP3
+MAX_PASSTHROUGH_BITRATE = 128000
+SEGMENT_AUDIO_BITRATE = "32k"
+SEGMENT_SAMPLE_RATE = 16000
+
+# 長音訊分段參數（秒）
+MAX_SEGMENT_DURATION = 600    # 最大分段時長
+OVERLAP_DURATION = 30         # 找不到靜音點時的重疊時長
+SILENCE_SEARCH_WINDOW = 30    # 在分段邊界前多少秒內尋找靜音點
+MIN_TAIL_DURATION = 180       # 剩餘長度不足此值時併入前一個分段，避免過短的尾段多一次請求
+
+# ffmpeg silencedetect 輸出的靜音起訖時間
+SILENCE_START_PATTERN = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END_PATTERN = re.compile(r"silence_end: (-?[\d.]+)")
+
+# session state 預設值（僅限不可變的值，避免不同工作階段共用同一物件）
+SESSION_DEFAULTS = {
+    "transcribed_text": None,
+    "input_tokens": 0,
+    "cached_input_tokens": 0,
+    "output_tokens": 0,
+    "total_tokens": 0,
+    "optimized_text": None,
+    "summary_text": None,
+    "markdown_text": None,
+    "markdown_keywords": None,
+    "transcription_prompt": "",
+    "optimization_prompt": "",
+    "transcription_job": None,
+    # 預設 API 金鑰與模型設定
+    "openai_api_key": "",
+    "elevenlabs_api_key": "",
+    "gemini_api_key": "",
+    "use_llm": False,
+    "openai_model": "o4-mini-transcribe",
+    "keyword_count": 10,
+    "optimization_model": "o4-mini",
+}
+
 # 定義可用的 OpenAI 模型
 AVAILABLE_MODELS = {
     "o4-mini": "o4-mini",  # 新模型放前面作為預設
@@ -132,6 +234,23 @@ OPTIMIZATION_SERVICE_INFO = {
     """
 }
 
+# 側邊欄選項（載入時建立一次，不在每次重新執行時建立）
+TRANSCRIPTION_SERVICES = ["OpenAI 2025 New", "Whisper", "ElevenLabs"]
+OPENAI_TRANSCRIBE_MODELS = ["gpt-4o-transcribe", "gpt-4o-mini-transcribe"]
+WHISPER_MODELS = ["tiny", "base", "small", "medium", "large"]
+GEMINI_MODELS = ["gemini-2.5-pro-preview-05-06", "gemini-2.5-flash-preview-04-17"]
+OUTPUT_FORMATS = ["純文字", "Markdown", "SRT (含時間戳)"]
+
+# 可指定的轉錄語言與對應的語言代碼
+TRANSCRIPTION_LANGUAGES = {
+    "中文 (繁體/簡體)": "zh",
+    "英文": "en",
+    "日文": "ja",
+    "韓文": "ko",
+    "其他": "custom"
+}
+TRANSCRIPTION_LANGUAGE_OPTIONS = list(TRANSCRIPTION_LANGUAGES)
+
 # MarkItDown 服務說明
 MARKITDOWN_SERVICE_INFO = """
 ### MarkItDown 文件轉換工具
@@ -146,25 +265,250 @@ SUPPORTED_FILE_TYPES = [
     "xlsx", "xls", "csv", "txt", "rtf", 
     "html", "htm", "md", "markdown"
 ]
+SUPPORTED_IMAGE_TYPES = ["jpg", "jpeg", "png"]
+
+# 分類上傳檔案時使用的圖片副檔名集合
+SUPPORTED_IMAGE_EXTENSIONS = frozenset(SUPPORTED_IMAGE_TYPES)
+
+# 合併所有支持的檔案類型
+ALL_SUPPORTED_FILE_TYPES = SUPPORTED_FILE_TYPES + SUPPORTED_IMAGE_TYPES
+
+# 上傳區域的檔案類型說明（載入時組合一次，不在每次重新執行時組合）
+SUPPORTED_FILE_TYPES_INFO = f"""
+支持以下檔案類型：
+- 文件：{", ".join(ext.upper() for ext in SUPPORTED_FILE_TYPES)}
+- 圖片：{", ".join(ext.upper() for ext in SUPPORTED_IMAGE_TYPES)}
+
+檔案大小限制：每個檔案 200MB
+"""
+
+# Gemini 文字優化提示詞；固定的指示與格式範例放在前面，變動的上下文與原始文字放在最後，
+# 讓每次請求共用相同的前綴以利 Gemini 的隱式快取
+GEMINI_REFINE_PROMPT = """
+請將以下文字優化為一份結構完整、格式豐富的會議記錄或講稿草稿。
+無論輸入文字是簡體或繁體中文，請務必將所有輸出轉換為繁體中文。
+
+# 任務要求
+1. **基本要求**
+   - 將所有文字轉換為繁體中文
+   - 保持原意的情況下讓文字更通順、專業
+   - 製作重點摘要（300字以內）
+
+2. **格式要求**（請參考以下範例格式）
+   - 使用 `---` 作為主要分隔線
+   - 使用 `# ## ###` 等標題層級區分主題
+   - 使用 `**粗體**` 標示：
+     * 標題（如：**標題：**）
+     * 講者（如：**[講者]:**）
+     * 關鍵詞或重要概念
+   - 使用 `-` 或 `*` 製作項目清單，支援多層縮排
+   - 使用 `>` 製作引用區塊（適用於重要引述）
+   - 適當使用 `*斜體*` 強調次要重點
+
+# 請按照以下格式回應（必須使用繁體中文）
+
+[優化後文字]
+---
+
+**(會議記錄/講稿草稿 - 詳細版)**
+
+**標題：** [主要標題]
+
+**日期：** [日期，若有]
+**參與者：** [相關人員，若有]
 
-def encode_image_to_base64(image_path: str) -> str:
+## 1. 背景說明
+**主要議題：**
+- 重點一
+  - 細節說明
+  - 補充資訊
+- 重點二
+  - 相關數據
+  - 具體案例
+
+**[發言者姓名/角色]:** 「重要發言內容...」
+
+## 2. 討論內容
+### 2.1 議題探討
+**現況分析：**
+- **目前進度：** 說明...
+- **遇到挑戰：**
+  - 挑戰一
+  - 挑戰二
+
+**解決方案：**
+1. 方案一
+   - 優點：...
+   - 考量：...
+2. 方案二
+   - 建議做法：...
+   - 所需資源：...
+
+### 2.2 決議事項
+**結論：**
+- 重要決定一
+- 重要決定二
+
+## 3. 後續規劃
+**時程安排：**
+- 短期目標（1個月內）
+- 中期目標（3個月內）
+- 長期目標（6個月以上）
+
+**待辦事項：**
+1. 優先處理：...
+2. 後續追蹤：...
+
+---
+
+[重點摘要]
+## 會議重點摘要
+
+**核心議題：**
+1. 主要討論重點
+   - 關鍵發現
+   - 重要決議
+
+**執行方向：**
+- 近期行動項目
+  - 負責單位
+  - 時程規劃
+
+**注意事項：**
+- 需要特別關注的議題
+- 潛在風險與因應措施
+
+# 上下文資訊
+{context}
+
+# 原始文字
+{text}
+"""
+
+# 短文字不套用完整會議記錄格式的字數門檻
+SHORT_TEXT_THRESHOLD = 500
+
+# Gemini 短文字優化提示詞
+GEMINI_SHORT_REFINE_PROMPT = """
+請將以下文字修正為通順、專業的繁體中文，保持原意，不要套用會議記錄格式。
+無論輸入文字是簡體或繁體中文，請務必將所有輸出轉換為繁體中文。
+
+# 請按照以下格式回應（必須使用繁體中文）
+
+[優化後文字]
+（修正後的文字）
+
+[重點摘要]
+（一至三句重點摘要）
+
+# 上下文資訊
+{context}
+
+# 原始文字
+{text}
+"""
+
+class BoundedCache:
+    """執行緒安全的有界快取，超過上限時依插入順序淘汰最舊的項目
+    
+    背景執行緒與不同工作階段會同時讀寫同一個快取，所有操作都在鎖內完成。
     """
-    將圖片編碼為 base64 字串
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        """取得快取值，不存在時返回 default"""
+        with self._lock:
+            return self._data.get(key, default)
+    
+    def set(self, key, value):
+        """寫入快取值，超過上限時淘汰最舊的項目"""
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.pop(next(iter(self._data)))
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache(name, max_entries):
+    """取得跨重新執行與工作階段共用的具名結果快取
+    
+    快取鍵由呼叫端以內容雜湊與設定組成，不可包含 API 金鑰。
     
     Args:
-        image_path (str): 圖片檔案路徑
-        
+        name (str): 快取名稱，區分不同用途的快取
+        max_entries (int): 最大筆數
+    
     Returns:
-        str: base64 編碼的圖片字串
+        BoundedCache: 有界快取
     """
-    try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except Exception as e:
-        logger.error(f"圖片編碼失敗: {str(e)}")
-        return ""
+    return BoundedCache(max_entries)
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    """取得 OpenAI 客戶端，相同 API 金鑰在重新執行間共用連線池
+    
+    Args:
+        api_key (str): OpenAI API 金鑰
+    
+    Returns:
+        OpenAI: OpenAI 客戶端
+    """
+    return OpenAI(api_key=api_key, max_retries=MAX_RETRIES)
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key):
+    """取得 Gemini 生成服務客戶端，相同 API 金鑰在重新執行與工作階段間共用
+    
+    金鑰綁定在客戶端本身，不使用 genai.configure 的行程全域設定，
+    不同金鑰的請求可同時進行而不互相影響。
+    
+    Args:
+        api_key (str): Gemini API 金鑰
+    
+    Returns:
+        GenerativeServiceClient: Gemini 生成服務客戶端
+    """
+    # 延遲導入，只使用 OpenAI 或 Step 1 時不需載入 Gemini SDK
+    from google.ai import generativelanguage as glm
+    
+    return glm.GenerativeServiceClient(client_options={"api_key": api_key})
 
-def generate_srt_from_json(json_responses, segment_duration=600, overlap_duration=30):
+def generate_gemini_content(api_key, model_name, prompt, generation_config=None, stream=False):
+    """以指定 API 金鑰的共用客戶端呼叫 Gemini 生成內容
+    
+    Args:
+        api_key (str): Gemini API 金鑰
+        model_name (str): Gemini 模型名稱
+        prompt (str): 提示詞
+        generation_config (dict, optional): 生成設定，例如 temperature
+        stream (bool): 是否以串流方式接收回應
+    
+    Returns:
+        GenerateContentResponse: Gemini 回應；串流模式時為可迭代的回應
+    """
+    import google.generativeai as genai
+    from google.ai import generativelanguage as glm
+    
+    client = get_gemini_client(api_key)
+    request = glm.GenerateContentRequest(
+        model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+        contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+        generation_config=glm.GenerationConfig(**(generation_config or {}))
+    )
+    
+    # 以 SDK 的回應包裝保留 .text 與 usage_metadata 等介面
+    if stream:
+        return genai.types.GenerateContentResponse.from_iterator(
+            client.stream_generate_content(request)
+        )
+    return genai.types.GenerateContentResponse.from_response(
+        client.generate_content(request)
+    )
+
+def generate_srt_from_json(json_responses, segment_duration=600, overlap_duration=30, segment_offsets=None):
     """
     從 JSON 格式的轉錄結果生成 SRT 字幕
     
@@ -172,6 +516,7 @@ def generate_srt_from_json(json_responses, segment_duration=600, overlap_duratio
         json_responses: JSON 格式的轉錄回應列表
         segment_duration: 每段音頻長度（秒）
         overlap_duration: 重疊時長（秒）
+        segment_offsets: 各分段在原始音訊中的開始秒數；提供時取代以固定長度推算的偏移
     
     Returns:
         SRT 格式的字幕文字
@@ -184,7 +529,10 @@ def generate_srt_from_json(json_responses, segment_duration=600, overlap_duratio
             continue
             
         # 計算此分段的時間偏移
-        segment_offset = max(0, segment_idx * segment_duration - overlap_duration if segment_idx > 0 else 0)
+        if segment_offsets is not None:
+            segment_offset = segment_offsets[segment_idx]
+        else:
+            segment_offset = max(0, segment_idx * segment_duration - overlap_duration if segment_idx > 0 else 0)
         
         # 檢查 JSON 回應是否包含 words 或 segments 信息
         try:
@@ -281,43 +629,710 @@ def format_srt_time(seconds):
     
     return f"{hours:02d}:{minutes:02d}:{secs:02d},{milliseconds:03d}"
 
-def calculate_cost(input_tokens, output_tokens, model_name, is_cached=False):
-    """計算 API 使用成本
+def probe_audio_duration(file_path):
+    """使用 ffprobe 讀取音訊長度，不需將整個檔案解碼為 PCM
+    
+    Args:
+        file_path (str): 音訊檔案路徑
+    
+    Returns:
+        float: 音訊長度（秒）
+    
+    Raises:
+        RuntimeError: ffprobe 無法執行或無法讀取長度時
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                file_path
+            ],
+            capture_output=True, text=True, timeout=60
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        raise RuntimeError(f"無法讀取音訊長度: {e}") from e
+
+def cut_audio_segment(input_path, output_path, start, end, reencode=False):
+    """使用 ffmpeg 直接擷取音訊片段，優先以串流複製避免重新編碼
+    
+    Args:
+        input_path (str): 原始音訊檔案路徑
+        output_path (str): 分段輸出路徑（副檔名需與原始檔案相同）
+        start (float): 開始時間（秒）
+        end (float): 結束時間（秒）
+        reencode (bool, optional): 是否直接重新編碼為低位元率 MP3 以縮小上傳量. 預設為 False
+    
+    Returns:
+        str: 實際輸出的分段檔案路徑；重新編碼時為低位元率單聲道 MP3 檔案
+    
+    Raises:
+        RuntimeError: ffmpeg 無法擷取片段時
+    """
+    base_cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-ss", str(start), "-t", str(end - start),
+        "-i", input_path
+    ]
+    if not reencode:
+        result = subprocess.run(
+            base_cmd + ["-c", "copy", output_path],
+            capture_output=True, text=True
+        )
+        if result.returncode == 0:
+            return output_path
+        
+        # 部分容器格式無法直接串流複製，改為重新編碼
+        logger.warning(f"串流複製分段失敗，改為重新編碼: {result.stderr.strip()}")
+    
+    # 重新編碼為 16 kHz 單聲道低位元率 MP3（足以供語音辨識使用）
+    mp3_path = os.path.splitext(output_path)[0] + ".mp3"
+    result = subprocess.run(
+        base_cmd + [
+            "-vn", "-ac", "1", "-ar", str(SEGMENT_SAMPLE_RATE),
+            "-b:a", SEGMENT_AUDIO_BITRATE, "-acodec", "libmp3lame", mp3_path
+        ],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"擷取音訊片段失敗: {result.stderr.strip()}")
+    return mp3_path
+
+def detect_silences(file_path, noise_db=-35, min_silence_len=0.5):
+    """使用 ffmpeg silencedetect 濾鏡找出音訊中的靜音區段
+    
+    Args:
+        file_path (str): 音訊檔案路徑
+        noise_db (int, optional): 視為靜音的音量門檻（dB）. 預設為 -35
+        min_silence_len (float, optional): 最短靜音長度（秒）. 預設為 0.5
+    
+    Returns:
+        list: [(開始秒數, 結束秒數), ...]；無法偵測時返回空列表
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg", "-v", "info", "-i", file_path, "-vn",
+                "-af", f"silencedetect=noise={noise_db}dB:d={min_silence_len}",
+                "-f", "null", "-"
+            ],
+            capture_output=True, text=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"靜音偵測失敗: {e}")
+        return []
+    
+    starts = [float(m) for m in SILENCE_START_PATTERN.findall(result.stderr)]
+    ends = [float(m) for m in SILENCE_END_PATTERN.findall(result.stderr)]
+    return list(zip(starts, ends))
+
+def plan_segment_boundaries(duration_seconds, silences):
+    """規劃長音訊的分段時間範圍，優先在靜音處切分
+    
+    每個分段最長 MAX_SEGMENT_DURATION 秒。若邊界前 SILENCE_SEARCH_WINDOW 秒內有靜音，
+    在最接近邊界的靜音中點切分且不重疊；否則在邊界處切分並保留 OVERLAP_DURATION 秒重疊。
+    剩餘長度不足 MIN_TAIL_DURATION 秒時併入最後一個分段，不再單獨切出。
+    
+    Args:
+        duration_seconds (float): 音訊總長度（秒）
+        silences (list): detect_silences 返回的靜音區段
+    
+    Returns:
+        list: [(分段開始秒數, 分段結束秒數), ...]
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    boundaries = []
+    start_time = 0.0
+    segment_start = 0.0
+    
+    while start_time < duration_seconds:
+        target = start_time + MAX_SEGMENT_DURATION
+        if target + MIN_TAIL_DURATION >= duration_seconds:
+            boundaries.append((segment_start, duration_seconds))
+            break
+        
+        candidates = [
+            m for m in midpoints
+            if target - SILENCE_SEARCH_WINDOW <= m <= target
+        ]
+        if candidates:
+            end_time = max(candidates)
+            next_start = end_time
+        else:
+            end_time = target
+            next_start = end_time - OVERLAP_DURATION
+        
+        boundaries.append((segment_start, end_time))
+        start_time = end_time
+        segment_start = next_start
+    
+    return boundaries
+
+def transcribe_segment_openai(
+    client, segment_path, model, language_code, prompt, api_format,
+    audio_data=None
+):
+    """使用 OpenAI API 轉錄單一音訊分段，暫時性錯誤由客戶端內建的重試機制處理
+    
+    此函數會在背景執行緒中執行，因此不可存取 st.session_state 或呼叫 st.* 元件。
+    
+    Args:
+        client (OpenAI): OpenAI 客戶端
+        segment_path (str): 分段音訊檔案路徑
+        model (str): 轉錄模型名稱
+        language_code (str): 語言代碼
+        prompt (str): 轉錄提示詞
+        api_format (str): API 回應格式（"json" 或 "text"）
+        audio_data (tuple, optional): (檔名, 記憶體中的音訊檔案物件)；提供時直接上傳其內容，不再讀取 segment_path
+    
+    Returns:
+        tuple: (轉錄結果, 錯誤訊息)；成功時錯誤訊息為 None，失敗時結果為空字串
+    """
+    # 超過上傳上限的分段必然被拒絕，直接回報錯誤，不浪費請求與重試等待
+    if audio_data is None:
+        segment_size = os.path.getsize(segment_path)
+    else:
+        with audio_data[1].getbuffer() as audio_view:
+            segment_size = audio_view.nbytes
+    if segment_size > OPENAI_MAX_UPLOAD_BYTES:
+        error_msg = (
+            f"分段檔案 {segment_size / 1000 / 1000:.1f} MB 超過 OpenAI 25 MB 上傳上限"
+        )
+        logger.error("處理分段 %s 略過：%s", segment_path, error_msg)
+        return "", error_msg
+    
+    try:
+        if audio_data is None:
+            audio_source = open(segment_path, "rb")
+        else:
+            # 直接串流上傳記憶體中的檔案物件，不另外複製一份位元組
+            audio_data[1].seek(0)
+            audio_source = nullcontext(audio_data)
+        with audio_source as audio_file:
+            response = client.audio.transcriptions.create(
+                model=model,
+                file=audio_file,
+                language=language_code,
+                response_format=api_format,
+                prompt=prompt,
+                temperature=0.3
+            )
+        if api_format == "json":
+            # JSON 格式，儲存完整回應以供後續處理
+            logger.info(f"JSON 回應長度: {len(str(response))}")
+            return response, None
+        # TEXT 格式，使用 .text 屬性
+        text_result = response.text if hasattr(response, 'text') else str(response)
+        logger.info(f"文字結果長度: {len(text_result)}")
+        return text_result, None
+    except Exception as e:
+        error_msg = str(e)
+        logger.error("處理分段 %s 失敗：%s", segment_path, error_msg)
+        return "", error_msg
+
+def transcribe_segment(segment_path, settings, api_format, audio_data=None):
+    """依設定的轉錄服務轉錄單一音訊分段，相同內容與設定的分段直接使用磁碟快取
+    
+    此函數會在背景執行緒中執行，因此不可存取 st.session_state 或呼叫 st.* 元件。
+    
+    Args:
+        segment_path (str): 分段音訊檔案路徑
+        settings (dict): 轉錄設定
+        api_format (str): OpenAI API 回應格式（"json" 或 "text"）
+        audio_data (tuple, optional): (檔名, 記憶體中的音訊檔案物件)；僅 OpenAI 使用
+    
+    Returns:
+        tuple: (轉錄結果, 錯誤訊息)；成功時錯誤訊息為 None，失敗時結果為空字串
+    """
+    service = settings["service"]
+    
+    # 空白分段不需上傳，避免一次必然失敗的請求
+    if audio_data is None and os.path.getsize(segment_path) == 0:
+        logger.warning("分段 %s 為空檔案，略過轉錄", segment_path)
+        return "", None
+    
+    # 以分段內容雜湊與轉錄設定查詢磁碟快取；JSON 回應物件無法以文字保存，不使用快取
+    cache_path = None
+    if (api_format == "text" or service != "OpenAI 2025 New") and ensure_transcription_cache_dir():
+        digest = hashlib.blake2b(digest_size=16)
+        if audio_data is not None:
+            with audio_data[1].getbuffer() as audio_view:
+                digest.update(audio_view)
+        else:
+            # 分塊讀取計算雜湊，不將整個分段載入記憶體
+            with open(segment_path, "rb") as audio_file:
+                for chunk in iter(lambda: audio_file.read(UPLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        for value in (
+            service,
+            settings["openai_model"] if service == "OpenAI 2025 New" else settings["whisper_model"],
+            settings["language_code"],
+            settings["transcription_prompt"]
+        ):
+            digest.update(f"\0{value or ''}".encode("utf-8"))
+        cache_path = os.path.join(TRANSCRIPTION_CACHE_DIR, f"{digest.hexdigest()}.txt")
+        try:
+            with open(cache_path, "r", encoding="utf-8") as cache_file:
+                cached_result = cache_file.read()
+            # 更新修改時間，清理時較晚淘汰常用的結果
+            os.utime(cache_path)
+            logger.info("使用快取的分段轉錄結果：%s", cache_path)
+            return cached_result, None
+        except OSError:
+            pass
+    
+    result, error_msg = _transcribe_segment_uncached(
+        segment_path, settings, api_format, audio_data
+    )
+    
+    # 成功的結果以原子方式寫入快取
+    if cache_path and result and not error_msg:
+        try:
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            # 逐字稿僅限目前使用者讀取
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                cache_file.write(result)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"寫入轉錄快取失敗: {e}")
+        prune_transcription_cache()
+    
+    return result, error_msg
+
+def ensure_transcription_cache_dir():
+    """建立僅限目前使用者存取（0o700）的轉錄快取目錄
+    
+    停用快取，或目錄無法建立、屬於其他使用者時返回 False，此時不讀寫快取，
+    避免在共用的暫存目錄中讀取他人放置的檔案或洩漏逐字稿。
+    
+    Returns:
+        bool: 快取目錄是否可安全使用
+    """
+    if not TRANSCRIPTION_CACHE_ENABLED:
+        return False
+    try:
+        os.makedirs(TRANSCRIPTION_CACHE_DIR, mode=0o700, exist_ok=True)
+        if hasattr(os, "getuid"):
+            stat = os.stat(TRANSCRIPTION_CACHE_DIR)
+            if stat.st_uid != os.getuid():
+                logger.warning(f"轉錄快取目錄不屬於目前使用者，停用快取: {TRANSCRIPTION_CACHE_DIR}")
+                return False
+            if stat.st_mode & 0o077:
+                os.chmod(TRANSCRIPTION_CACHE_DIR, 0o700)
+        return True
+    except OSError as e:
+        logger.warning(f"建立轉錄快取目錄失敗: {e}")
+        return False
+
+def prune_transcription_cache():
+    """清理分段轉錄的磁碟快取
+    
+    刪除超過 TRANSCRIPTION_CACHE_MAX_AGE 的檔案；總大小仍超過
+    TRANSCRIPTION_CACHE_MAX_BYTES 時，由最久未使用的檔案開始刪除。
+    其他執行緒正在清理時直接略過。
+    """
+    if not TRANSCRIPTION_CACHE_PRUNE_LOCK.acquire(blocking=False):
+        return
+    try:
+        now = time.time()
+        entries = []
+        with os.scandir(TRANSCRIPTION_CACHE_DIR) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # 寫入中的暫存檔只在過期（異常中斷遺留）時清理
+                if entry.name.endswith(".tmp") and now - stat.st_mtime <= TRANSCRIPTION_CACHE_MAX_AGE:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= TRANSCRIPTION_CACHE_MAX_AGE and total_bytes <= TRANSCRIPTION_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+    except OSError as e:
+        logger.warning(f"清理轉錄快取失敗: {e}")
+    finally:
+        TRANSCRIPTION_CACHE_PRUNE_LOCK.release()
+
+def _transcribe_segment_uncached(segment_path, settings, api_format, audio_data=None):
+    """實際呼叫轉錄服務轉錄單一分段，參數與返回值同 transcribe_segment"""
+    service = settings["service"]
+    if service == "OpenAI 2025 New":
+        return transcribe_segment_openai(
+            settings["openai_client"],
+            segment_path,
+            settings["openai_model"],
+            settings["language_code"],
+            settings["transcription_prompt"],
+            api_format,
+            audio_data
+        )
+    
+    if service == "Whisper":
+        result = transcribe_audio_whisper(
+            segment_path,
+            model_name=settings["whisper_model"],
+            language=settings["language_code"],
+            initial_prompt=settings["transcription_prompt"]
+        )
+    else:  # ElevenLabs
+        result = transcribe_audio_elevenlabs(
+            api_key=settings["elevenlabs_api_key"],
+            file_path=segment_path,
+            language_code="zho",  # 指定中文
+            diarize=False  # 取消啟用說話者辨識
+        )
+    
+    if isinstance(result, dict) and result.get("text"):
+        return result["text"], None
+    return "", f"{service} 轉錄失敗"
+
+def merge_segment_results(segment_results, output_format, segment_offsets):
+    """依輸出格式合併各分段的轉錄結果
+    
+    Args:
+        segment_results (list): 依分段順序排列的轉錄結果
+        output_format (str): 輸出格式（"純文字"、"Markdown" 或 "SRT (含時間戳)"）
+        segment_offsets (list): 各分段在原始音訊中的開始秒數
+    
+    Returns:
+        str: 合併後的轉錄文字
+    """
+    if output_format == "SRT (含時間戳)":
+        # 使用 JSON 回應生成 SRT
+        return generate_srt_from_json(
+            segment_results,
+            segment_offsets=segment_offsets
+        )
+    
+    # 從結果中提取文字內容
+    text_parts = []
+    for result in segment_results:
+        if hasattr(result, 'text'):
+            text_parts.append(result.text)
+        else:
+            text_parts.append(str(result))
+    raw_text = " ".join(text_parts)
+    
+    if output_format == "Markdown":
+        return f"# 語音轉錄結果\n\n{raw_text}\n"
+    return raw_text
+
+def run_transcription_job(job, uploaded_file, temp_path, suffix, settings):
+    """在背景執行緒中完成分段與轉錄，並將進度與結果寫入 job
+    
+    此函數不可存取 st.session_state 或呼叫 st.* 元件；要顯示給用戶的訊息
+    以 (層級, 內容) 形式加入 job["messages"]，由主執行緒輪詢時顯示。
+    
+    Args:
+        job (dict): 工作狀態，包含 status、completed、total、messages、result
+        uploaded_file (UploadedFile): 上傳的音訊檔案
+        temp_path (str): 上傳檔案的臨時檔案路徑
+        suffix (str): 上傳檔案的副檔名
+        settings (dict): 轉錄設定（服務、客戶端與 API 金鑰、模型、語言、提示詞與輸出格式）
+    """
+    service = settings["service"]
+    audio_segments = [temp_path]
+    boundaries = None
+    # 所有分段放在同一個臨時目錄，結束時一次移除
+    segment_dir = tempfile.mkdtemp(prefix="speech2text_segments_")
+    
+    try:
+        # 檢查音訊長度
+        try:
+            duration_seconds = probe_audio_duration(temp_path)
+        except Exception as audio_error:
+            # 如果無法使用 ffprobe（通常是缺少 ffmpeg），直接處理整個檔案
+            logger.warning(f"無法分析音訊長度（可能缺少 ffmpeg）: {audio_error}")
+            job["messages"].append(
+                ("warning", "⚠️ 偵測到缺少 ffmpeg，將直接處理整個音訊檔案（可能較慢）")
+            )
+            duration_seconds = 0  # 設為 0 以跳過分段邏輯
+        
+        # 上傳至雲端服務時，高位元率檔案（如 WAV、FLAC 或含影像的影片）先壓縮以減少上傳量
+        reencode = (
+            service != "Whisper"
+            and duration_seconds > 0
+            and os.path.getsize(temp_path) * 8 / duration_seconds > MAX_PASSTHROUGH_BITRATE
+        )
+        
+        # 如果音訊超過 10 分鐘（僅略長時整段處理，不切出過短的尾段）
+        if duration_seconds > MAX_SEGMENT_DURATION + MIN_TAIL_DURATION:
+            job["messages"].append(("info", "音訊較長，將於靜音處分段處理..."))
+            logger.info(
+                "音訊檔案長度: %.2f 秒，開始分段處理",
+                duration_seconds
+            )
+            
+            # 在靜音處規劃分段，找不到靜音時才保留重疊
+            boundaries = plan_segment_boundaries(
+                duration_seconds,
+                detect_silences(temp_path)
+            )
+            segment_offsets = [start for start, _ in boundaries]
+            logger.info(
+                "規劃分段完成，共 %d 個分段",
+                len(boundaries)
+            )
+        else:
+            segment_offsets = [0.0]
+            logger.info("音訊長度適中，不需分段處理")
+            if reencode:
+                try:
+                    audio_segments = [cut_audio_segment(
+                        temp_path,
+                        os.path.join(segment_dir, f"segment_0{suffix}"),
+                        0,
+                        duration_seconds,
+                        reencode=True
+                    )]
+                except RuntimeError as e:
+                    logger.warning(f"壓縮音訊失敗，改為上傳原始檔案: {e}")
+        
+        total_segments = len(boundaries) if boundaries else len(audio_segments)
+        job["total"] = total_segments
+        
+        # GPT-4o 模型只支援 text 和 json 格式
+        # 根據官方文件，gpt-4o-transcribe 只支援 json 和 text
+        if settings["output_format"] == "SRT (含時間戳)":
+            api_format = "json"  # 使用 json 嘗試獲取時間信息
+        else:
+            api_format = "text"
+        
+        audio_data = None
+        if service == "OpenAI 2025 New":
+            logger.info(f"使用模型: {settings['openai_model']}")
+            logger.info(f"API 格式: {api_format}")
+            logger.info(f"語言代碼: {settings['language_code']}")
+            
+            # 不需分段時直接上傳記憶體中的上傳檔案物件，不再從磁碟讀回臨時檔案，也不複製其內容
+            if not boundaries and audio_segments == [temp_path]:
+                audio_data = (uploaded_file.name, uploaded_file)
+        
+        # 雲端 API 的分段並行轉錄；Whisper 在本機運算，逐一處理
+        if service == "Whisper":
+            max_workers = 1
+        else:
+            max_workers = min(MAX_TRANSCRIPTION_WORKERS, total_segments)
+        
+        # 依索引存放結果以確保完整排序
+        segment_results = [""] * total_segments
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, total_segments)
+        ) as cut_executor:
+            if boundaries:
+                # 並行擷取各音訊片段，每個片段擷取完成後立即送出轉錄，
+                # 讓 ffmpeg 擷取與轉錄請求重疊進行
+                cut_futures = {
+                    cut_executor.submit(
+                        cut_audio_segment,
+                        temp_path,
+                        os.path.join(segment_dir, f"segment_{i}{suffix}"),
+                        segment_start,
+                        end_time,
+                        reencode=reencode
+                    ): i
+                    for i, (segment_start, end_time) in enumerate(boundaries)
+                }
+                ready_segments = (
+                    (cut_futures[cut_future], cut_future.result())
+                    for cut_future in as_completed(cut_futures)
+                )
+            else:
+                ready_segments = enumerate(audio_segments)
+            
+            future_to_index = {}
+            for i, segment_path in ready_segments:
+                if boundaries:
+                    logger.info(
+                        "儲存分段 %d，時間範圍：%.2f - %.2f 秒",
+                        i + 1,
+                        *boundaries[i]
+                    )
+                future_to_index[executor.submit(
+                    transcribe_segment,
+                    segment_path,
+                    settings,
+                    api_format,
+                    audio_data
+                )] = i
+            for future in as_completed(future_to_index):
+                i = future_to_index[future]
+                result, error_msg = future.result()
+                segment_results[i] = result
+                if error_msg:
+                    # 顯示錯誤給用戶
+                    prefix = "OpenAI API 錯誤" if service == "OpenAI 2025 New" else "轉錄錯誤"
+                    job["messages"].append(("error", f"{prefix}: {error_msg}"))
+                else:
+                    logger.info(
+                        "成功轉錄分段 %d/%d",
+                        i + 1,
+                        total_segments
+                    )
+                
+                # 更新進度
+                job["completed"] += 1
+        
+        # 增加調試日誌
+        logger.info(f"共處理 {len(segment_results)} 個分段結果")
+        
+        # 合併結果
+        full_transcript = merge_segment_results(
+            segment_results,
+            settings["output_format"],
+            segment_offsets
+        )
+        
+        # 添加調試日誌
+        logger.info(f"轉錄結果長度: {len(full_transcript) if full_transcript else 0}")
+        logger.info("完成所有分段的轉錄與合併")
+        
+        if full_transcript and full_transcript.strip():
+            job["result"] = full_transcript
+            job["status"] = "done"
+        else:
+            job["messages"].append(("error", "轉錄失敗或結果為空"))
+            logger.error("轉錄失敗：結果為空或無效")
+            job["status"] = "error"
+    
+    except Exception as e:
+        job["messages"].append(("error", f"處理失敗：{str(e)}"))
+        logger.error(f"處理失敗：{str(e)}")
+        job["status"] = "error"
+    
+    finally:
+        # 清理臨時檔案；結果已寫入 job，清理不影響用戶等待時間
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        try:
+            os.remove(temp_path)
+            logger.info("已清理臨時檔案：%s", temp_path)
+        except Exception as e:
+            logger.error("清理臨時檔案失敗：%s", str(e))
+
+def poll_transcription_job():
+    """背景轉錄工作存在時，稍候後重新執行腳本以更新進度與取回結果"""
+    if st.session_state.get("transcription_job"):
+        time.sleep(TRANSCRIPTION_POLL_INTERVAL)
+        st.rerun()
+
+@st.cache_data(show_spinner=False)
+def calculate_cost(input_tokens, output_tokens, model_name, cached_input_tokens=0):
+    """計算 API 使用成本，命中提示快取的輸入 tokens 以快取價格計算
     
     Args:
-        input_tokens (int): 輸入 tokens 數量
+        input_tokens (int): 輸入 tokens 數量（包含快取命中的部分）
         output_tokens (int): 輸出 tokens 數量
         model_name (str): 模型名稱
-        is_cached (bool, optional): 是否使用快取輸入價格. 預設為 False
+        cached_input_tokens (int, optional): 命中提示快取的輸入 tokens 數量. 預設為 0
     
     Returns:
         tuple: (USD 成本, NTD 成本, 詳細計算資訊)
     """
-    if model_name not in MODEL_CONFIG:
-        return 0, 0, "未支援的模型"
-        
     # 取得價格設定
-    model = MODEL_CONFIG[model_name]
-    input_price = model["cached_input"] if is_cached else model["input"]
+    model = MODEL_CONFIG.get(model_name)
+    if model is None:
+        return 0, 0, "未支援的模型"
+    
+    input_price = model["input"]
+    cached_input_price = model["cached_input"]
     output_price = model["output"]
     
+    # 價格待定（免費）或尚無 token 使用量時不需計算明細
+    if input_price == 0 and cached_input_price == 0 and output_price == 0:
+        return 0, 0, f"{model['display_name']}: 免費 / 價格待定"
+    if input_tokens == 0 and output_tokens == 0:
+        return 0, 0, "尚無 token 使用量"
+    
     # 計算 USD 成本 (以每 1M tokens 為單位)
-    input_cost = (input_tokens / 1_000_000) * input_price
+    cached_input_tokens = min(cached_input_tokens, input_tokens)
+    uncached_input_tokens = input_tokens - cached_input_tokens
+    input_cost = (uncached_input_tokens / 1_000_000) * input_price
+    cached_input_cost = (cached_input_tokens / 1_000_000) * cached_input_price
     output_cost = (output_tokens / 1_000_000) * output_price
-    total_cost_usd = input_cost + output_cost
+    total_cost_usd = input_cost + cached_input_cost + output_cost
     total_cost_ntd = total_cost_usd * USD_TO_NTD
     
     # 準備詳細計算資訊
     details = f"""
     計算明細 (USD):
-    - 輸入: {input_tokens:,} tokens × ${input_price}/1M = ${input_cost:.4f}
+    - 輸入: {uncached_input_tokens:,} tokens × ${input_price}/1M = ${input_cost:.4f}
+    - 快取輸入: {cached_input_tokens:,} tokens × ${cached_input_price}/1M = ${cached_input_cost:.4f}
     - 輸出: {output_tokens:,} tokens × ${output_price}/1M = ${output_cost:.4f}
     - 總計 (USD): ${total_cost_usd:.4f}
     - 總計 (NTD): NT${total_cost_ntd:.2f}
     """
     return total_cost_usd, total_cost_ntd, details
 
-def refine_transcript_gemini(text, api_key, temperature=0.5, context=""):
+def reuse_cached_refine_result(result):
+    """取得快取優化結果的副本，token 使用量歸零，避免未實際呼叫的 API 再次計費
+    
+    Args:
+        result (dict): 快取中的優化結果
+    
+    Returns:
+        dict: 使用量歸零並標記為快取的結果副本
+    """
+    usage = {
+        key: 0 if key.startswith("total_") else value
+        for key, value in result.get("usage", {}).items()
+    }
+    usage["total_cached_input_tokens"] = 0
+    return dict(result, usage=usage, cached=True)
+
+def refine_transcript_openai(text, api_key, model, temperature=0.5, context="", placeholder=None):
+    """使用 OpenAI 模型優化文字，相同輸入直接返回快取結果
+
+    Args:
+        text (str): 要優化的文字
+        api_key (str): OpenAI API 金鑰
+        model (str): 模型名稱
+        temperature (float): 創意程度 (0.0-1.0)
+        context (str): 上下文提示
+        placeholder (st.delta_generator.DeltaGenerator, optional): 提供時以串流方式即時顯示修正後的文字
+
+    Returns:
+        dict: 包含優化後的文字和摘要；失敗時返回 None
+    """
+    result_cache = get_result_cache("openai_refine", OPENAI_REFINE_CACHE_MAX_ENTRIES)
+    cache_key = (
+        hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        model,
+        temperature,
+        context
+    )
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info("使用快取的 OpenAI 優化結果")
+        return reuse_cached_refine_result(cached_result)
+    
+    result = refine_transcript(
+        raw_text=text,
+        api_key=api_key,
+        model=model,
+        temperature=temperature,
+        context=context,
+        client=get_openai_client(api_key),
+        placeholder=placeholder
+    )
+    
+    if result:
+        # 儲存至快取，超過上限時淘汰最舊的項目
+        result_cache.set(cache_key, result)
+    return result
+
+def refine_transcript_gemini(text, api_key, temperature=0.5, context="", placeholder=None):
     """使用 Gemini 模型優化文字
 
     Args:
@@ -325,172 +1340,148 @@ def refine_transcript_gemini(text, api_key, temperature=0.5, context=""):
         api_key (str): Gemini API 金鑰
         temperature (float): 創意程度 (0.0-1.0)
         context (str): 上下文提示
+        placeholder (st.delta_generator.DeltaGenerator, optional): 提供時以串流方式即時顯示生成內容
 
     Returns:
         dict: 包含優化後的文字和摘要
     """
+    # 空白輸入不需呼叫 API
+    if not text or not text.strip():
+        return {
+            "corrected": text,
+            "summary": "",
+            "usage": {
+                "total_input_tokens": 0,
+                "total_output_tokens": 0
+            }
+        }
+    
     try:
-        genai.configure(api_key=api_key)
         # 使用 session_state 中選擇的模型，如果未設置則使用預設值
         model_name = st.session_state.get("gemini_model", "gemini-2.5-pro-preview-05-06")
-        model = genai.GenerativeModel(model_name)
-        
-        # 準備提示詞
-        prompt = f"""
-        請將以下文字優化為一份結構完整、格式豐富的會議記錄或講稿草稿。
-        無論輸入文字是簡體或繁體中文，請務必將所有輸出轉換為繁體中文。
-
-        # 任務要求
-        1. **基本要求**
-           - 將所有文字轉換為繁體中文
-           - 保持原意的情況下讓文字更通順、專業
-           - 製作重點摘要（300字以內）
-
-        2. **格式要求**（請參考以下範例格式）
-           - 使用 `---` 作為主要分隔線
-           - 使用 `# ## ###` 等標題層級區分主題
-           - 使用 `**粗體**` 標示：
-             * 標題（如：**標題：**）
-             * 講者（如：**[講者]:**）
-             * 關鍵詞或重要概念
-           - 使用 `-` 或 `*` 製作項目清單，支援多層縮排
-           - 使用 `>` 製作引用區塊（適用於重要引述）
-           - 適當使用 `*斜體*` 強調次要重點
-
-        # 上下文資訊
-        {context if context else "無特定上下文"}
-
-        # 原始文字
-        {text}
-
-        # 請按照以下格式回應（必須使用繁體中文）
-
-        [優化後文字]
-        ---
-
-        **(會議記錄/講稿草稿 - 詳細版)**
-
-        **標題：** [主要標題]
-
-        **日期：** [日期，若有]
-        **參與者：** [相關人員，若有]
-
-        ## 1. 背景說明
-        **主要議題：**
-        - 重點一
-          - 細節說明
-          - 補充資訊
-        - 重點二
-          - 相關數據
-          - 具體案例
-
-        **[發言者姓名/角色]:** 「重要發言內容...」
-
-        ## 2. 討論內容
-        ### 2.1 議題探討
-        **現況分析：**
-        - **目前進度：** 說明...
-        - **遇到挑戰：**
-          - 挑戰一
-          - 挑戰二
-
-        **解決方案：**
-        1. 方案一
-           - 優點：...
-           - 考量：...
-        2. 方案二
-           - 建議做法：...
-           - 所需資源：...
-
-        ### 2.2 決議事項
-        **結論：**
-        - 重要決定一
-        - 重要決定二
-
-        ## 3. 後續規劃
-        **時程安排：**
-        - 短期目標（1個月內）
-        - 中期目標（3個月內）
-        - 長期目標（6個月以上）
-
-        **待辦事項：**
-        1. 優先處理：...
-        2. 後續追蹤：...
-
-        ---
-
-        [重點摘要]
-        ## 會議重點摘要
-
-        **核心議題：**
-        1. 主要討論重點
-           - 關鍵發現
-           - 重要決議
         
-        **執行方向：**
-        - 近期行動項目
-          - 負責單位
-          - 時程規劃
+        # 相同輸入直接返回快取結果，不再呼叫 API
+        result_cache = get_result_cache("gemini_refine", GEMINI_CACHE_MAX_ENTRIES)
+        cache_key = (
+            hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            model_name,
+            temperature,
+            context
+        )
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("使用快取的 Gemini 優化結果")
+            return reuse_cached_refine_result(cached_result)
         
-        **注意事項：**
-        - 需要特別關注的議題
-        - 潛在風險與因應措施
-        """
+        # 準備提示詞；短文字使用精簡提示詞，避免生成冗長的會議記錄架構
+        template = (
+            GEMINI_SHORT_REFINE_PROMPT if len(text) < SHORT_TEXT_THRESHOLD
+            else GEMINI_REFINE_PROMPT
+        )
+        prompt = template.format(
+            context=context if context else "無特定上下文",
+            text=text
+        )
         
-        response = model.generate_content(
+        response = generate_gemini_content(
+            api_key,
+            model_name,
             prompt,
             generation_config={
                 'temperature': temperature
-            }
+            },
+            stream=placeholder is not None
         )
         
+        if placeholder is not None:
+            # 串流接收回應並即時顯示
+            chunks = []
+            for chunk in response:
+                chunks.append(chunk.text)
+                placeholder.markdown("".join(chunks))
+            response_text = "".join(chunks)
+        else:
+            response_text = response.text
+        
         # 解析回應
-        response_text = response.text
         
-        # 使用新的分隔方式解析回應
-        if "[優化後文字]" in response_text and "[重點摘要]" in response_text:
-            parts = response_text.split("[重點摘要]")
-            corrected = parts[0].split("[優化後文字]")[1].strip()
-            summary = parts[1].strip()
+        # 使用新的分隔方式解析回應，找不到標記時嘗試使用舊的分隔方式
+        match = (
+            GEMINI_RESPONSE_PATTERN.search(response_text)
+            or GEMINI_LEGACY_RESPONSE_PATTERN.search(response_text)
+        )
+        if match:
+            corrected = match.group(1).strip()
+            summary = match.group(2).strip()
         else:
-            # 如果找不到標記，嘗試使用舊的分隔方式
-            parts = response_text.split("重點摘要：")
-            if len(parts) >= 2:
-                corrected = parts[0].strip()
-                summary = parts[1].strip()
-            else:
-                corrected = response_text
-                summary = "無法生成摘要"
+            corrected = response_text
+            summary = "無法生成摘要"
         
-        return {
+        # 使用 API 回報的 token 數量，若無則以約 4 字元 1 token 估算
+        usage_metadata = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(usage_metadata, "prompt_token_count", 0) or len(prompt) // 4
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or len(response_text) // 4
+        
+        result = {
             "corrected": corrected,
             "summary": summary,
             "usage": {
-                "total_input_tokens": 0,  # Gemini 暫時不計算 tokens
-                "total_output_tokens": 0
+                "total_input_tokens": input_tokens,
+                "total_output_tokens": output_tokens
             }
         }
+        
+        # 儲存至快取，超過上限時淘汰最舊的項目
+        result_cache.set(cache_key, result)
+        
+        return result
     except Exception as e:
         logger.error(f"Gemini API 錯誤：{str(e)}")
         return None
 
+@lru_cache(maxsize=8)
+def remove_markdown(text):
+    """移除文字中的 Markdown 標記與多餘空行，產生純文字結果
+    
+    Args:
+        text (str): 含 Markdown 標記的文字
+    
+    Returns:
+        str: 純文字內容
+    """
+    # 一次移除標題符號 (#)、粗體/斜體標記 (*) 與分隔線 (---)
+    text = MARKDOWN_SYMBOL_PATTERN.sub("", text)
+    # 移除多餘的空行
+    return "\n".join(
+        line.strip()
+        for line in text.split("\n")
+        if line.strip()
+    )
+
 def display_cost_info(
     input_tokens,
     output_tokens,
     model_name,
-    is_cached=False
+    cached_input_tokens=0
 ):
-    """在 Streamlit 介面中顯示成本資訊"""
-    cost_usd, cost_ntd, details = calculate_cost(
+    """在 Streamlit 介面中顯示成本資訊
+    
+    Returns:
+        tuple: calculate_cost 的結果 (USD 成本, NTD 成本, 明細)，供呼叫端重用
+    """
+    cost_result = calculate_cost(
         input_tokens,
         output_tokens,
         model_name,
-        is_cached
+        cached_input_tokens
     )
+    cost_usd, cost_ntd, details = cost_result
     
     with st.sidebar.expander("💰 成本計算", expanded=True):
         st.write("### Token 使用量")
         st.write(f"- 輸入: {input_tokens:,} tokens")
+        if cached_input_tokens:
+            st.write(f"- 其中快取命中: {cached_input_tokens:,} tokens")
         st.write(f"- 輸出: {output_tokens:,} tokens")
         st.write(f"- 總計: {input_tokens + output_tokens:,} tokens")
         
@@ -500,8 +1491,44 @@ def display_cost_info(
         st.write("### 費用明細")
         st.text(details)
         
-        if is_cached:
-            st.info("✨ 使用快取價格計算")
+        if cached_input_tokens:
+            st.info("✨ 快取命中的輸入 tokens 以快取價格計算")
+    
+    return cost_result
+
+def convert_uploaded_document(uploaded_file, use_llm, api_key, model="gpt-4o"):
+    """將上傳的文件儲存為臨時檔案並轉換為 Markdown
+    
+    此函數會在背景執行緒中執行，因此不可呼叫 st.* 元件；快取由呼叫端在主執行緒處理。
+    
+    Args:
+        uploaded_file: Streamlit 上傳的檔案物件
+        use_llm (bool): 是否使用 Vision API 處理
+        api_key (str): OpenAI API Key
+        model (str, optional): Vision API 模型名稱. 預設為 "gpt-4o"
+    
+    Returns:
+        tuple: (是否成功, Markdown 文字, 轉換資訊)
+    """
+    success, temp_path = save_uploaded_file(uploaded_file)
+    if not success:
+        return False, "", {"error": f"處理上傳檔案時發生錯誤: {temp_path}"}
+    
+    try:
+        success, md_text, info = convert_file_to_markdown(
+            input_path=temp_path,
+            use_llm=use_llm,
+            api_key=api_key,
+            model=model
+        )
+    finally:
+        # 清理臨時檔案
+        try:
+            os.remove(temp_path)
+        except Exception as e:
+            logger.error(f"清理臨時檔案失敗: {str(e)}")
+    
+    return success, md_text, info
 
 def process_markdown_extraction(text, api_key, model, keyword_count):
     """
@@ -530,6 +1557,96 @@ def process_markdown_extraction(text, api_key, model, keyword_count):
         logger.error(f"提取關鍵詞失敗: {str(e)}")
         return []
 
+def render_keyword_results(session):
+    """
+    顯示已提取的關鍵詞，並提供下載與編輯功能
+    
+    Args:
+        session (SessionState): Streamlit 的 session state
+    """
+    markdown_keywords = session.markdown_keywords
+    if markdown_keywords:
+        # 顯示關鍵詞
+        st.write("### 提取的關鍵詞")
+        for i, kw in enumerate(markdown_keywords):
+            st.write(f"{i+1}. {kw}")
+        
+        # 複製關鍵詞按鈕
+        keywords_text = "\n".join(markdown_keywords)
+        st.download_button(
+            label="📋 下載關鍵詞列表",
+            data=keywords_text,
+            file_name="keywords.txt",
+            mime="text/plain",
+            help="下載提取的關鍵詞列表",
+            use_container_width=True
+        )
+        
+        # 添加編輯關鍵詞的功能
+        if st.button("✏️ 編輯關鍵詞", use_container_width=True):
+            # 將關鍵詞列表顯示在文本區域中供編輯
+            st.session_state.editing_keywords = True
+            st.rerun()
+        
+        # 當處於編輯模式時顯示編輯界面
+        if session.editing_keywords:
+            edit_keywords = st.text_area(
+                "編輯關鍵詞（每行一個）",
+                value=keywords_text,
+                height=200
+            )
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("✅ 確認修改", use_container_width=True):
+                    # 將編輯後的文本轉換為列表
+                    edited_keywords = [
+                        kw.strip() 
+                        for kw in edit_keywords.split("\n") 
+                        if kw.strip()
+                    ]
+                    if edited_keywords:
+                        kw_len = len(edited_keywords)
+                        update_msg = (
+                            f"已更新關鍵詞列表，共 {kw_len} 個關鍵詞"
+                        )
+                        st.session_state.markdown_keywords = (
+                            edited_keywords
+                        )
+                        st.session_state.editing_keywords = False
+                        st.success(update_msg)
+            
+            with col2:
+                if st.button("❌ 取消編輯", use_container_width=True):
+                    st.session_state.editing_keywords = False
+                    st.rerun()
+
+def render_enhanced_slides(session):
+    """
+    顯示已增強的幻燈片內容及下載按鈕
+    
+    Args:
+        session (SessionState): Streamlit 的 session state
+    """
+    enhanced_slides = session.enhanced_slides
+    if enhanced_slides:
+        st.markdown("### 已增強的幻燈片內容")
+        st.text_area(
+            "增強後的幻燈片內容",
+            enhanced_slides,
+            height=400
+        )
+        
+        # 下載按鈕
+        st.download_button(
+            label="📥 下載增強後的幻燈片",
+            data=enhanced_slides,
+            file_name="enhanced_slides.md",
+            mime="text/markdown",
+            help="下載增強後的幻燈片 Markdown 檔案",
+            use_container_width=True
+        )
+
 def render_markitdown_tab():
     """渲染 MarkItDown 標籤頁"""
     st.header("Step 1: 文件與圖像處理")
@@ -537,19 +1654,14 @@ def render_markitdown_tab():
     # MarkItDown 服務說明
     st.markdown(MARKITDOWN_SERVICE_INFO)
     
-    # 初始化 session state
-    if "markdown_text" not in st.session_state:
-        st.session_state.markdown_text = None
-    if "markdown_keywords" not in st.session_state:
-        st.session_state.markdown_keywords = None
-    if "analyzed_images" not in st.session_state:
-        st.session_state.analyzed_images = {}
-    if "enhanced_slides" not in st.session_state:
-        st.session_state.enhanced_slides = None
-    if "editing_keywords" not in st.session_state:
-        st.session_state.editing_keywords = False
-    if "transcription_prompt" not in st.session_state:
-        st.session_state.transcription_prompt = ""
+    # 初始化此標籤頁專用的 session state（共用的預設值已由 SESSION_DEFAULTS 設定）
+    session = st.session_state
+    session.setdefault("analyzed_images", {})
+    session.setdefault("enhanced_slides", None)
+    session.setdefault("editing_keywords", False)
+    
+    # 取得 OpenAI API 金鑰，整個標籤頁共用
+    openai_api_key = session.get("openai_api_key", "")
 
     # 創建兩個標籤頁：內容輸入和增強與分析
     tab1, tab2 = st.tabs(["📄 內容輸入", "✨ 增強與分析"])
@@ -567,297 +1679,352 @@ def render_markitdown_tab():
         
         if input_type == "檔案上傳":
             # 整合文件和圖片上傳為單一上傳區域
-            st.markdown("""
-            支持以下檔案類型：
-            - 文件：PDF, DOCX, DOC, PPTX, PPT, XLSX, XLS, CSV, TXT, RTF, HTML, 
-              HTM, MD, MARKDOWN
-            - 圖片：JPG, JPEG, PNG
-            
-            檔案大小限制：每個檔案 200MB
-            """)
-            
-            # 合併所有支持的檔案類型
-            all_supported_files = SUPPORTED_FILE_TYPES + ["jpg", "jpeg", "png"]
-            
-            # 單一上傳界面
-            uploaded_files = st.file_uploader(
-                "拖放檔案到此處上傳",
-                type=all_supported_files,
-                accept_multiple_files=True,
-                help="支持文件和圖片同時上傳，系統會自動識別檔案類型"
-            )
-            
-            # 檢查是否有 OpenAI API 金鑰
-            openai_api_key = st.session_state.get("openai_api_key", "")
+            st.markdown(SUPPORTED_FILE_TYPES_INFO)
             
-            # 添加 Vision API 選項
-            use_vision_api = st.checkbox(
-                "🔍 啟用進階 Vision API 分析 (適用於複雜 PPTX 圖片投影片)",
-                value=False,
-                help="使用進階 Vision API 將整個 PPTX 轉為圖片進行深度分析。即使不勾選，MarkItDown 也會自動處理文件中的圖片內容。需要 OpenAI API 金鑰。"
-            )
+            # 上傳與選項放在表單中，只有按下處理按鈕時才重新執行
+            with st.form("upload_form", clear_on_submit=False):
+                # 單一上傳界面
+                uploaded_files = st.file_uploader(
+                    "拖放檔案到此處上傳",
+                    type=ALL_SUPPORTED_FILE_TYPES,
+                    accept_multiple_files=True,
+                    help="支持文件和圖片同時上傳，系統會自動識別檔案類型"
+                )
+                
+                # 添加 Vision API 選項
+                use_vision_api = st.checkbox(
+                    "🔍 啟用進階 Vision API 分析 (適用於複雜 PPTX 圖片投影片)",
+                    value=False,
+                    help="使用進階 Vision API 將整個 PPTX 轉為圖片進行深度分析。即使不勾選，MarkItDown 也會自動處理文件中的圖片內容。需要 OpenAI API 金鑰。"
+                )
+                
+                process_btn = st.form_submit_button(
+                    "🔄 處理上傳內容",
+                    use_container_width=True
+                )
             
             # 如果啟用了 Vision API 但沒有 API 金鑰，顯示警告
             if use_vision_api and not openai_api_key:
                 st.warning("⚠️ 已啟用 Vision API，但未提供 OpenAI API 金鑰。請在側邊欄填入 API 金鑰以使用此功能。")
             
             # 處理說明
-            if uploaded_files:
-                # 分類上傳的檔案
-                doc_files = []
-                image_files = []
-                
-                for file in uploaded_files:
-                    file_ext = file.name.split('.')[-1].lower()
-                    if file_ext in ["jpg", "jpeg", "png"]:
-                        image_files.append(file)
-                    else:
-                        doc_files.append(file)
-                
-                # 顯示檔案資訊
-                if doc_files and image_files:
-                    st.info(
-                        f"已上傳 {len(doc_files)} 個文件和 {len(image_files)} 張圖片"
-                    )
-                    process_btn_label = "🔄 處理文件和分析圖片"
-                elif doc_files:
-                    st.info(f"已上傳 {len(doc_files)} 個文件")
-                    process_btn_label = "🔄 轉換文件為 Markdown"
-                elif image_files:
-                    st.info(f"已上傳 {len(image_files)} 張圖片")
-                    process_btn_label = "🔄 分析圖片"
-                else:
+            if process_btn:
+                if not uploaded_files:
                     st.warning("請上傳文件或圖片進行處理")
-                    return
-                
-                # 整合處理按鈕
-                if not openai_api_key:
+                elif not openai_api_key:
                     st.warning("請在側邊欄提供 OpenAI API 金鑰以進行分析")
                 else:
-                    process_btn = st.button(
-                        process_btn_label,
-                        use_container_width=True
-                    )
+                    # 分類上傳的檔案
+                    doc_files = []
+                    image_files = []
                     
-                    if process_btn:
-                        # 處理流程
-                        with st.spinner("正在處理..."):
-                            temp_markdown = ""
-                            
-                            # 處理文件（如果有）
-                            if doc_files:
-                                # 處理第一個文件（目前只支援處理一個文件）
-                                uploaded_file = doc_files[0]
+                    for file in uploaded_files:
+                        file_ext = os.path.splitext(file.name)[1][1:].lower()
+                        if file_ext in SUPPORTED_IMAGE_EXTENSIONS:
+                            image_files.append(file)
+                        else:
+                            doc_files.append(file)
+                    
+                    # 顯示檔案資訊
+                    if doc_files and image_files:
+                        st.info(
+                            f"已上傳 {len(doc_files)} 個文件和 {len(image_files)} 張圖片"
+                        )
+                    elif doc_files:
+                        st.info(f"已上傳 {len(doc_files)} 個文件")
+                    else:
+                        st.info(f"已上傳 {len(image_files)} 張圖片")
+                    
+                    # 處理流程；文件轉換與圖片分析都在背景執行緒並行進行
+                    with st.spinner("正在處理..."), ThreadPoolExecutor(
+                        max_workers=MAX_IMAGE_ANALYSIS_WORKERS
+                    ) as executor:
+                        temp_markdown = ""
+                        saved_images = []
+                        results = {}
+                        futures = {}
+                        
+                        # 先送出所有文件的轉換（如果有），相同內容與設定的文件直接使用快取結果
+                        conversion_cache = get_result_cache(
+                            "markdown_conversion",
+                            MARKDOWN_CACHE_MAX_ENTRIES
+                        )
+                        doc_jobs = []
+                        for doc_file in doc_files:
+                            cache_key = (
+                                hashlib.blake2b(
+                                    doc_file.getbuffer(),
+                                    digest_size=16
+                                ).hexdigest(),
+                                os.path.splitext(doc_file.name)[1].lower(),
+                                use_vision_api,
+                                "gpt-4o"
+                            )
+                            cached = conversion_cache.get(cache_key)
+                            future = None if cached is not None else executor.submit(
+                                convert_uploaded_document,
+                                doc_file,
+                                use_llm=use_vision_api,
+                                api_key=openai_api_key,
+                                model="gpt-4o"  # Vision API 需要 gpt-4o 模型
+                            )
+                            doc_jobs.append((doc_file.name, cache_key, cached, future))
+                        
+                        # 先保存圖片並送出分析請求（如果有）
+                        if image_files:
+                            image_data = {}
+                            for img_file in image_files:
                                 success, temp_path = save_uploaded_file(
-                                    uploaded_file
+                                    img_file
                                 )
-                                
                                 if success:
-                                    # 轉換檔案
-                                    st.info("正在轉換文件...")
-                                    success, md_text, info = (
-                                        convert_file_to_markdown(
-                                            input_path=temp_path,
-                                            use_llm=use_vision_api,
-                                            api_key=openai_api_key,
-                                            model="gpt-4o"  # Vision API 需要 gpt-4o 模型
-                                        )
-                                    )
-                                    
-                                    # 如果轉換失敗且是 magika 相關錯誤，提供修復建議
-                                    if not success and "magika" in str(info.get("error", "")).lower():
-                                        st.error("檔案轉換失敗：magika 套件配置問題")
-                                        st.markdown("""
-                                        **解決方案：**
-                                        1. 在終端機執行以下命令修復 magika 套件：
-                                        ```bash
-                                        python fix_magika.py
-                                        ```
-                                        
-                                        2. 或者手動執行：
-                                        ```bash
-                                        pip uninstall magika -y
-                                        pip install magika --no-cache-dir
-                                        ```
-                                        
-                                        3. 重新啟動應用程式
-                                        """)
-                                        # 跳過後續處理，直接返回
-                                        return
-                                    
-                                    # 清理臨時檔案
-                                    try:
-                                        os.remove(temp_path)
-                                    except Exception as e:
-                                        logger.error(
-                                            f"清理臨時檔案失敗: {str(e)}"
-                                        )
-                                        pass
-                                    
-                                    if success:
-                                        temp_markdown = md_text
-                                        st.success("文件轉換成功！")
-                                    else:
-                                        # 顯示錯誤資訊
-                                        st.error(
-                                            f"轉換失敗: {info.get('error', '未知錯誤')}"
-                                        )
+                                    # 分析時直接使用記憶體中的內容，不再讀回暫存檔
+                                    image_data[temp_path] = img_file.getvalue()
+                                    saved_images.append((
+                                        img_file.name,
+                                        temp_path,
+                                        hashlib.blake2b(
+                                            image_data[temp_path],
+                                            digest_size=16
+                                        ).hexdigest()
+                                    ))
                                 else:
                                     st.error(
                                         f"處理上傳檔案時發生錯誤: {temp_path}"
                                     )
                             
-                            # 處理圖片（如果有）
-                            if image_files:
-                                # 如果有文件轉換內容，添加分隔線和圖片分析標題
-                                if temp_markdown:
-                                    temp_markdown += "\n\n## 圖片分析\n\n"
+                            # 相同內容的圖片直接使用快取的分析結果；本次未呼叫 API，不計 token
+                            image_cache = get_result_cache(
+                                "image_analysis",
+                                IMAGE_ANALYSIS_CACHE_MAX_ENTRIES
+                            )
+                            image_paths = []
+                            for _, temp_path, image_hash in saved_images:
+                                cached = image_cache.get((image_hash, "o4-mini"))
+                                if cached:
+                                    results[temp_path] = dict(
+                                        cached,
+                                        tokens={
+                                            "prompt_tokens": 0,
+                                            "completion_tokens": 0,
+                                            "total_tokens": 0
+                                        },
+                                        cached=True
+                                    )
                                 else:
-                                    temp_markdown = "# 圖片分析結果\n\n"
-                                
-                                # 保存和分析圖片
-                                analyzed_count = 0
-                                progress_bar = st.progress(0)
-                                total_images = len(image_files)
+                                    image_paths.append(temp_path)
+                            
+                            # 每個請求批次分析數張圖片，各請求並行送出
+                            for start in range(
+                                0, len(image_paths), DEFAULT_BATCH_SIZE
+                            ):
+                                chunk = image_paths[start:start + DEFAULT_BATCH_SIZE]
+                                futures[executor.submit(
+                                    analyze_image_group,
+                                    [image_data[path] for path in chunk],
+                                    openai_api_key,
+                                    "o4-mini"  # 使用o4-mini模型
+                                )] = chunk
+                        
+                        # 依上傳順序取回文件轉換結果（如果有）
+                        if doc_files:
+                            st.info("正在轉換文件...")
+                            converted = []
+                            for doc_name, cache_key, cached, future in doc_jobs:
+                                if future is None:
+                                    logger.info("使用快取的文件轉換結果：%s", doc_name)
+                                    success, md_text, info = True, cached, {"cached": True}
+                                else:
+                                    success, md_text, info = future.result()
                                 
-                                for i, img_file in enumerate(image_files):
-                                    # 保存上傳的檔案
-                                    success, temp_path = save_uploaded_file(
-                                        img_file
-                                    )
+                                # 如果轉換失敗且是 magika 相關錯誤，提供修復建議
+                                if not success and "magika" in str(info.get("error", "")).lower():
+                                    st.error("檔案轉換失敗：magika 套件配置問題")
+                                    st.markdown("""
+                                    **解決方案：**
+                                    1. 在終端機執行以下命令修復 magika 套件：
+                                    ```bash
+                                    python fix_magika.py
+                                    ```
                                     
-                                    if success:
-                                        # 分析圖片
-                                        with st.spinner(
-                                            f"分析圖片 {i+1}/{total_images}..."
-                                        ):
-                                            result = analyze_image(
-                                                temp_path, 
-                                                openai_api_key, 
-                                                "o4-mini"  # 使用o4-mini模型
-                                            )
-                                        
-                                        if result["success"]:
-                                            # 儲存分析結果
-                                            img_analysis = {
-                                                "path": temp_path,
-                                                "description": (
-                                                    result["description"]
-                                                ),
-                                                "tokens": result["tokens"]
-                                            }
-                                            st.session_state.analyzed_images[
-                                                img_file.name
-                                            ] = img_analysis
-                                            
-                                            # 顯示圖片和分析結果
-                                            st.image(
-                                                temp_path, 
-                                                caption=img_file.name
-                                            )
-                                            st.markdown("### 分析結果")
-                                            st.markdown(result["description"])
-                                            st.markdown("---")
-                                            
-                                            # 添加到臨時 Markdown
-                                            md_title = f"### {img_file.name}\n\n"
-                                            temp_markdown += md_title
-                                            temp_markdown += (
-                                                f"![圖片]({temp_path})\n\n"
-                                            )
-                                            temp_markdown += (
-                                                f"{result['description']}\n\n"
-                                                f"---\n\n"
-                                            )
-                                            
-                                            # 增加處理圖片計數
-                                            analyzed_count += 1
-                                            
-                                            # 更新進度條
-                                            if progress_bar is not None:
-                                                progress_percentage = (
-                                                    analyzed_count / 
-                                                    total_images
-                                                )
-                                                progress_bar.progress(
-                                                    progress_percentage
-                                                )
-                                        else:
-                                            error_msg = result.get(
-                                                'error', '未知錯誤'
-                                            )
-                                            st.error(
-                                                f"分析失敗: {error_msg}"
-                                            )
-                                    else:
-                                        st.error(
-                                            f"處理上傳檔案時發生錯誤: {temp_path}"
-                                        )
+                                    2. 或者手動執行：
+                                    ```bash
+                                    pip uninstall magika -y
+                                    pip install magika --no-cache-dir
+                                    ```
+                                    
+                                    3. 重新啟動應用程式
+                                    """)
+                                    # 跳過後續處理，直接返回
+                                    for pending in futures:
+                                        pending.cancel()
+                                    for *_, pending in doc_jobs:
+                                        if pending is not None:
+                                            pending.cancel()
+                                    return
                                 
-                                # 顯示處理完成訊息
-                                if analyzed_count > 0:
-                                    msg = f"已完成 {analyzed_count} 張圖片的分析"
-                                    st.success(msg)
+                                if success:
+                                    if future is not None:
+                                        # 儲存至快取，超過上限時淘汰最舊的項目
+                                        conversion_cache.set(cache_key, md_text)
+                                    converted.append(md_text)
+                                    st.success(f"文件 {doc_name} 轉換成功！")
+                                else:
+                                    # 顯示錯誤資訊
+                                    st.error(
+                                        f"{doc_name} 轉換失敗: {info.get('error', '未知錯誤')}"
+                                    )
                             
-                            # 將分析結果存儲到 markdown_text 中
+                            # 多個文件以分隔線串接
+                            temp_markdown = "\n\n---\n\n".join(converted)
+                        
+                        # 處理圖片（如果有）
+                        if image_files:
+                            # 各段 Markdown 先收集在列表中，最後一次串接，避免迴圈中重複複製字串
+                            # 如果有文件轉換內容，添加分隔線和圖片分析標題
                             if temp_markdown:
-                                st.session_state.markdown_text = temp_markdown
-                                st.success("所有內容處理完成，可以進行後續分析")
-                                st.rerun()
-        
+                                markdown_parts = [temp_markdown, "\n\n## 圖片分析\n\n"]
+                            else:
+                                markdown_parts = ["# 圖片分析結果\n\n"]
+                            
+                            # 進度至少前進 PROGRESS_UPDATE_STEP 或全部完成時才更新進度條，
+                            # 減少傳送到前端的重繪訊息
+                            analyzed_count = 0
+                            total_images = len(saved_images)
+                            shown_progress = (
+                                len(results) / total_images if total_images else 0
+                            )
+                            progress_bar = st.progress(shown_progress)
+                            for future in as_completed(futures):
+                                results.update(
+                                    zip(futures[future], future.result())
+                                )
+                                progress = len(results) / total_images
+                                if (
+                                    progress - shown_progress >= PROGRESS_UPDATE_STEP
+                                    or progress == 1
+                                ):
+                                    progress_bar.progress(progress)
+                                    shown_progress = progress
+                            
+                            # 依上傳順序顯示分析結果
+                            for img_name, temp_path, image_hash in saved_images:
+                                result = results[temp_path]
+                                if result["success"]:
+                                    # 新的分析結果（含該圖片分攤的 token 數）儲存至快取
+                                    if not result.get("cached"):
+                                        image_cache.set((image_hash, "o4-mini"), result)
+                                    
+                                    # 儲存分析結果
+                                    img_analysis = {
+                                        "path": temp_path,
+                                        "description": (
+                                            result["description"]
+                                        ),
+                                        "tokens": result["tokens"]
+                                    }
+                                    st.session_state.analyzed_images[
+                                        img_name
+                                    ] = img_analysis
+                                    
+                                    # 顯示圖片和分析結果；直接使用記憶體中的內容，不經由磁碟檔案
+                                    st.image(
+                                        image_data[temp_path],
+                                        caption=img_name
+                                    )
+                                    st.markdown("### 分析結果")
+                                    st.markdown(result["description"])
+                                    st.markdown("---")
+                                    
+                                    # 添加到臨時 Markdown
+                                    markdown_parts.append(
+                                        f"### {img_name}\n\n"
+                                        f"![圖片]({temp_path})\n\n"
+                                        f"{result['description']}\n\n"
+                                        f"---\n\n"
+                                    )
+                                    
+                                    # 增加處理圖片計數
+                                    analyzed_count += 1
+                                else:
+                                    error_msg = result.get(
+                                        'error', '未知錯誤'
+                                    )
+                                    st.error(
+                                        f"分析失敗: {error_msg}"
+                                    )
+                            
+                            temp_markdown = "".join(markdown_parts)
+                            
+                            # 顯示處理完成訊息
+                            if analyzed_count > 0:
+                                msg = f"已完成 {analyzed_count} 張圖片的分析"
+                                st.success(msg)
+                        
+                        # 將分析結果存儲到 markdown_text 中
+                        if temp_markdown:
+                            st.session_state.markdown_text = temp_markdown
+                            st.success("所有內容處理完成，可以進行後續分析")
+                            st.rerun()
+    
         else:  # 直接輸入
-            # 文字輸入區域
-            user_text = st.text_area(
-                "直接輸入文字",
-                placeholder="在此輸入您的文字內容...",
-                help="直接輸入要處理的文字內容",
-                height=300
-            )
-            
-            # 新增：轉錄提示設定
-            st.markdown("### 轉錄提示設定")
-            st.markdown("""
-            提供提示可以幫助模型更準確地識別特定術語、專有名詞或領域特定詞彙。
-            """)
-            
-            transcription_prompt = st.text_area(
-                "轉錄提示 (可選)",
-                value=st.session_state.get("transcription_prompt", ""),
-                placeholder="例如：這是一段醫學演講，可能包含以下專業術語: 高血壓、糖尿病、心肌梗塞...",
-                help="提供上下文或領域特定的詞彙，以增強轉錄準確性"
-            )
-            
-            # 儲存到 session state
-            st.session_state["transcription_prompt"] = transcription_prompt
-            
-            if user_text:
+            # 文字與提示放在表單中，輸入時不會觸發重新執行
+            with st.form("text_input_form", clear_on_submit=False):
+                # 文字輸入區域
+                user_text = st.text_area(
+                    "直接輸入文字",
+                    placeholder="在此輸入您的文字內容...",
+                    help="直接輸入要處理的文字內容",
+                    height=300
+                )
+                
+                # 新增：轉錄提示設定
+                st.markdown("### 轉錄提示設定")
+                st.markdown("""
+                提供提示可以幫助模型更準確地識別特定術語、專有名詞或領域特定詞彙。
+                """)
+                
+                transcription_prompt = st.text_area(
+                    "轉錄提示 (可選)",
+                    value=st.session_state.get("transcription_prompt", ""),
+                    placeholder="例如：這是一段醫學演講，可能包含以下專業術語: 高血壓、糖尿病、心肌梗塞...",
+                    help="提供上下文或領域特定的詞彙，以增強轉錄準確性"
+                )
+                
                 # 處理按鈕
-                process_text_btn = st.button(
+                process_text_btn = st.form_submit_button(
                     "✅ 處理文字內容",
                     use_container_width=True
                 )
+            
+            if process_text_btn:
+                # 儲存到 session state
+                st.session_state["transcription_prompt"] = transcription_prompt
                 
-                if process_text_btn:
+                if user_text:
                     # 儲存用戶輸入的文字
                     st.session_state.markdown_text = user_text
                     st.success(
                         f"文字內容已處理！長度: {len(user_text)} 字元"
                     )
                     st.rerun()
+                else:
+                    st.warning("請輸入文字內容")
     
     # 增強與分析標籤頁
     with tab2:
         st.subheader("文本增強與分析")
         
         # 是否有內容可以進行增強與分析
-        if not st.session_state.markdown_text:
+        markdown_text = session.markdown_text
+        if not markdown_text:
             st.info("請先在「內容輸入」標籤頁上傳文件、圖片或輸入文字")
             return
         
         # 顯示 Markdown 文字
         st.text_area(
             "內容預覽",
-            st.session_state.markdown_text,
+            markdown_text,
             height=250
         )
         
@@ -866,41 +2033,47 @@ def render_markitdown_tab():
         
         enhancement_type = st.radio(
             "選擇增強類型",
-            ["提取關鍵詞", "幻燈片增強", "傳送至優化功能"],
+            ["提取關鍵詞", "幻燈片增強", "全部執行", "傳送至優化功能"],
             horizontal=True
         )
         
         # 檢查 API 金鑰是否存在
-        openai_api_key = st.session_state.get("openai_api_key", "")
-        if not openai_api_key and enhancement_type in ["提取關鍵詞", "幻燈片增強"]:
+        if not openai_api_key and enhancement_type in ["提取關鍵詞", "幻燈片增強", "全部執行"]:
             st.warning("請在側邊欄提供 OpenAI API 金鑰以進行增強操作")
         
         # 根據增強類型顯示不同的選項
         if enhancement_type == "提取關鍵詞" and openai_api_key:
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                model_for_keywords = st.selectbox(
-                    "選擇模型",
-                    ["gpt-4o", "gpt-4o-mini"],
-                    index=1,
-                    help="選擇用於提取關鍵詞的模型"
-                )
-            
-            with col2:
-                keyword_count = st.number_input(
-                    "關鍵詞數量",
-                    min_value=5,
-                    max_value=50,
-                    value=10,
-                    help="要提取的關鍵詞數量"
+            # 關鍵詞選項放在表單中，只有按下提取按鈕時才重新執行
+            with st.form("keyword_form", clear_on_submit=False):
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    model_for_keywords = st.selectbox(
+                        "選擇模型",
+                        ["gpt-4o", "gpt-4o-mini"],
+                        index=1,
+                        help="選擇用於提取關鍵詞的模型"
+                    )
+                
+                with col2:
+                    keyword_count = st.number_input(
+                        "關鍵詞數量",
+                        min_value=5,
+                        max_value=50,
+                        value=10,
+                        help="要提取的關鍵詞數量"
+                    )
+                
+                # 提取關鍵詞按鈕
+                extract_btn = st.form_submit_button(
+                    "🔍 提取關鍵詞",
+                    use_container_width=True
                 )
             
-            # 提取關鍵詞按鈕
-            if st.button("🔍 提取關鍵詞", use_container_width=True):
+            if extract_btn:
                 # 提取關鍵詞
                 keywords = process_markdown_extraction(
-                    st.session_state.markdown_text,
+                    markdown_text,
                     openai_api_key,
                     model_for_keywords,
                     keyword_count
@@ -912,61 +2085,7 @@ def render_markitdown_tab():
                     st.rerun()
             
             # 顯示已提取的關鍵詞
-            if st.session_state.markdown_keywords:
-                # 顯示關鍵詞
-                st.write("### 提取的關鍵詞")
-                for i, kw in enumerate(st.session_state.markdown_keywords):
-                    st.write(f"{i+1}. {kw}")
-                
-                # 複製關鍵詞按鈕
-                keywords_text = "\n".join(st.session_state.markdown_keywords)
-                st.download_button(
-                    label="📋 下載關鍵詞列表",
-                    data=keywords_text,
-                    file_name="keywords.txt",
-                    mime="text/plain",
-                    help="下載提取的關鍵詞列表",
-                    use_container_width=True
-                )
-                
-                # 添加編輯關鍵詞的功能
-                if st.button("✏️ 編輯關鍵詞", use_container_width=True):
-                    # 將關鍵詞列表顯示在文本區域中供編輯
-                    st.session_state.editing_keywords = True
-                    st.rerun()
-                
-                # 當處於編輯模式時顯示編輯界面
-                if st.session_state.get("editing_keywords", False):
-                    edit_keywords = st.text_area(
-                        "編輯關鍵詞（每行一個）",
-                        value="\n".join(st.session_state.markdown_keywords),
-                        height=200
-                    )
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("✅ 確認修改", use_container_width=True):
-                            # 將編輯後的文本轉換為列表
-                            edited_keywords = [
-                                kw.strip() 
-                                for kw in edit_keywords.split("\n") 
-                                if kw.strip()
-                            ]
-                            if edited_keywords:
-                                kw_len = len(edited_keywords)
-                                update_msg = (
-                                    f"已更新關鍵詞列表，共 {kw_len} 個關鍵詞"
-                                )
-                                st.session_state.markdown_keywords = (
-                                    edited_keywords
-                                )
-                                st.session_state.editing_keywords = False
-                                st.success(update_msg)
-                    
-                    with col2:
-                        if st.button("❌ 取消編輯", use_container_width=True):
-                            st.session_state.editing_keywords = False
-                            st.rerun()
+            render_keyword_results(session)
         
         elif enhancement_type == "幻燈片增強" and openai_api_key:
             # 幻燈片增強說明
@@ -1006,7 +2125,7 @@ def render_markitdown_tab():
                 with st.spinner("正在增強幻燈片內容..."):
                     # 增強幻燈片
                     result = enhance_slides(
-                        st.session_state.markdown_text, 
+                        markdown_text, 
                         openai_api_key, 
                         slide_model
                     )
@@ -1014,50 +2133,105 @@ def render_markitdown_tab():
                     # 將結果儲存到 session state
                     st.session_state.enhanced_slides = result["enhanced_text"]
                     
-                    # 顯示統計資訊
+                    # 顯示統計資訊；以單一表格呈現，減少傳送到前端的元件數
+                    stats = result["stats"]
                     st.markdown("### 處理統計")
-                    st.write(f"處理幻燈片數量: {result['stats']['slides_processed']}")
-                    st.write(f"處理圖片數量: {result['stats']['images_processed']}")
-                    st.write(f"成功分析圖片: {result['stats']['images_analyzed']}")
-                    st.write(f"分析失敗圖片: {result['stats']['images_failed']}")
-                    st.write(f"使用 Tokens: {result['stats']['total_tokens']}")
-                    
-                    # 顯示增強後的內容
-                    st.markdown("### 增強後的內容")
-                    st.text_area(
-                        "增強後的幻燈片內容",
-                        result["enhanced_text"],
-                        height=400
+                    st.table({
+                        "指標": [
+                            "處理幻燈片數量",
+                            "處理圖片數量",
+                            "成功分析圖片",
+                            "分析失敗圖片",
+                            "使用 Tokens"
+                        ],
+                        "數值": [
+                            stats["slides_processed"],
+                            stats["images_processed"],
+                            stats["images_analyzed"],
+                            stats["images_failed"],
+                            stats["total_tokens"]
+                        ]
+                    })
+            
+            # 顯示已增強的幻燈片（剛完成增強時也只在此顯示一次）
+            render_enhanced_slides(session)
+        
+        elif enhancement_type == "全部執行" and openai_api_key:
+            # 同時執行關鍵詞提取與幻燈片增強，兩者互不相依，可並行呼叫 API
+            with st.form("run_all_form", clear_on_submit=False):
+                col1, col2, col3 = st.columns(3)
+                
+                with col1:
+                    model_for_keywords = st.selectbox(
+                        "關鍵詞模型",
+                        ["gpt-4o", "gpt-4o-mini"],
+                        index=1,
+                        help="選擇用於提取關鍵詞的模型"
                     )
-                    
-                    # 下載按鈕
-                    st.download_button(
-                        label="📥 下載增強後的幻燈片",
-                        data=result["enhanced_text"],
-                        file_name="enhanced_slides.md",
-                        mime="text/markdown",
-                        help="下載增強後的幻燈片 Markdown 檔案",
-                        use_container_width=True
+                
+                with col2:
+                    keyword_count = st.number_input(
+                        "關鍵詞數量",
+                        min_value=5,
+                        max_value=50,
+                        value=10,
+                        help="要提取的關鍵詞數量"
+                    )
+                
+                with col3:
+                    slide_model = st.selectbox(
+                        "幻燈片模型",
+                        ["gpt-4o", "gpt-4o-mini"],
+                        index=1,
+                        help="選擇用於幻燈片增強的模型"
                     )
-            
-            # 顯示已增強的幻燈片
-            if st.session_state.enhanced_slides and not st.button:
-                st.markdown("### 已增強的幻燈片內容")
-                st.text_area(
-                    "增強後的幻燈片內容",
-                    st.session_state.enhanced_slides,
-                    height=400
-                )
                 
-                # 下載按鈕
-                st.download_button(
-                    label="📥 下載增強後的幻燈片",
-                    data=st.session_state.enhanced_slides,
-                    file_name="enhanced_slides.md",
-                    mime="text/markdown",
-                    help="下載增強後的幻燈片 Markdown 檔案",
+                run_all_btn = st.form_submit_button(
+                    "🚀 同時執行",
                     use_container_width=True
                 )
+            
+            if run_all_btn:
+                with st.spinner("正在提取關鍵詞並增強幻燈片..."), ThreadPoolExecutor(
+                    max_workers=2
+                ) as executor:
+                    keywords_future = executor.submit(
+                        extract_keywords,
+                        markdown_text=markdown_text,
+                        api_key=openai_api_key,
+                        model=model_for_keywords,
+                        count=keyword_count
+                    )
+                    slides_future = executor.submit(
+                        enhance_slides,
+                        markdown_text,
+                        openai_api_key,
+                        slide_model
+                    )
+                    
+                    try:
+                        keywords = keywords_future.result()
+                        if keywords:
+                            session.markdown_keywords = keywords
+                            st.success(f"成功提取 {len(keywords)} 個關鍵詞")
+                    except Exception as e:
+                        st.error(f"提取關鍵詞失敗: {str(e)}")
+                        logger.error(f"提取關鍵詞失敗: {str(e)}")
+                    
+                    try:
+                        result = slides_future.result()
+                        session.enhanced_slides = result["enhanced_text"]
+                        st.success(
+                            f"幻燈片增強完成，共處理 "
+                            f"{result['stats']['slides_processed']} 張幻燈片"
+                        )
+                    except Exception as e:
+                        st.error(f"幻燈片增強失敗: {str(e)}")
+                        logger.error(f"幻燈片增強失敗: {str(e)}")
+            
+            # 顯示兩項操作的結果，與各自單獨執行時的介面相同
+            render_keyword_results(session)
+            render_enhanced_slides(session)
         
         elif enhancement_type == "傳送至優化功能":
             # 傳送至優化功能
@@ -1065,14 +2239,14 @@ def render_markitdown_tab():
                 "📤 傳送至文字優化功能 (Step 3)",
                 use_container_width=True
             ):
-                st.session_state.transcribed_text = st.session_state.markdown_text
+                session.transcribed_text = markdown_text
                 st.success("內容已傳送至文字優化功能 (Step 3)！")
                 st.rerun()
         
         # 下載原始 Markdown 檔案
         st.download_button(
             label="📥 下載 Markdown 檔案",
-            data=st.session_state.markdown_text,
+            data=markdown_text,
             file_name="content.md",
             mime="text/markdown",
             help="下載當前內容的 Markdown 檔案",
@@ -1083,43 +2257,9 @@ def main():
     """主程式函數"""
     st.title("音訊轉文字與文件處理系統")
     
-    # 初始化 session state
-    if "transcribed_text" not in st.session_state:
-        st.session_state.transcribed_text = None
-    if "input_tokens" not in st.session_state:
-        st.session_state.input_tokens = 0
-    if "output_tokens" not in st.session_state:
-        st.session_state.output_tokens = 0
-    if "total_tokens" not in st.session_state:
-        st.session_state.total_tokens = 0
-    if "optimized_text" not in st.session_state:
-        st.session_state.optimized_text = None
-    if "summary_text" not in st.session_state:
-        st.session_state.summary_text = None
-    if "markdown_text" not in st.session_state:
-        st.session_state.markdown_text = None
-    if "markdown_keywords" not in st.session_state:
-        st.session_state.markdown_keywords = None
-    if "transcription_prompt" not in st.session_state:
-        st.session_state.transcription_prompt = ""
-    if "optimization_prompt" not in st.session_state:
-        st.session_state.optimization_prompt = ""
-    
-    # 設定預設API金鑰
-    if "openai_api_key" not in st.session_state:
-        st.session_state["openai_api_key"] = ""
-    if "elevenlabs_api_key" not in st.session_state:
-        st.session_state["elevenlabs_api_key"] = ""
-    if "gemini_api_key" not in st.session_state:
-        st.session_state["gemini_api_key"] = ""
-    if "use_llm" not in st.session_state:
-        st.session_state["use_llm"] = False
-    if "openai_model" not in st.session_state:
-        st.session_state["openai_model"] = "o4-mini-transcribe"
-    if "keyword_count" not in st.session_state:
-        st.session_state["keyword_count"] = 10
-    if "optimization_model" not in st.session_state:
-        st.session_state["optimization_model"] = "o4-mini"
+    # 初始化 session state，已存在的值（例如用戶輸入的 API 金鑰）不會被覆寫
+    for key, value in SESSION_DEFAULTS.items():
+        st.session_state.setdefault(key, value)
 
     # 創建主要的功能標籤頁，添加步驟編號
     tabs_titles = [
@@ -1135,6 +2275,10 @@ def main():
     
     # 語音轉文字標籤頁 (Step 2)
     with main_tabs[1]:
+        # 僅在對應轉錄服務的設定中覆寫
+        language_code = None
+        whisper_model = None
+        
         with st.sidebar:
             st.header("設定")
             
@@ -1146,7 +2290,7 @@ def main():
                 # 選擇轉錄服務
                 transcription_service = st.selectbox(
                     "選擇轉錄服務",
-                    options=["OpenAI 2025 New", "Whisper", "ElevenLabs"],
+                    options=TRANSCRIPTION_SERVICES,
                     index=0,
                     help="選擇要使用的語音轉文字服務"
                 )
@@ -1169,7 +2313,7 @@ def main():
                     # 允許用戶選擇轉錄模型
                     transcribe_model = st.radio(
                         "選擇轉錄模型",
-                        options=["gpt-4o-transcribe", "gpt-4o-mini-transcribe"],
+                        options=OPENAI_TRANSCRIBE_MODELS,
                         index=1,  # 預設使用mini版本
                         help=("gpt-4o-transcribe：高精度、多語言支援；"
                              "gpt-4o-mini-transcribe：輕量快速、性價比高")
@@ -1185,17 +2329,9 @@ def main():
                     
                     # 語言設定
                     if language_mode == "指定語言":
-                        languages = {
-                            "中文 (繁體/簡體)": "zh",
-                            "英文": "en",
-                            "日文": "ja",
-                            "韓文": "ko",
-                            "其他": "custom"
-                        }
-                        
                         selected_lang = st.selectbox(
                             "選擇語言",
-                            options=list(languages.keys())
+                            options=TRANSCRIPTION_LANGUAGE_OPTIONS
                         )
                         
                         if selected_lang == "其他":
@@ -1206,14 +2342,14 @@ def main():
                             )
                             language_code = custom_lang if custom_lang else None
                         else:
-                            language_code = languages[selected_lang]
+                            language_code = TRANSCRIPTION_LANGUAGES[selected_lang]
                     else:
                         language_code = None
                     
                     # 輸出格式設定
                     output_format = st.radio(
                         "輸出格式",
-                        options=["純文字", "Markdown", "SRT (含時間戳)"],
+                        options=OUTPUT_FORMATS,
                         index=0,
                         help=("純文字：標準轉錄文字；"
                              "Markdown：結構化格式；"
@@ -1235,7 +2371,7 @@ def main():
                 elif transcription_service == "Whisper":
                     whisper_model = st.selectbox(
                         "選擇 Whisper 模型",
-                        options=["tiny", "base", "small", "medium", "large"],
+                        options=WHISPER_MODELS,
                         index=2
                     )
                     st.session_state["whisper_model"] = whisper_model
@@ -1249,17 +2385,9 @@ def main():
                     )
                     
                     if language_mode == "指定語言":
-                        languages = {
-                            "中文 (繁體/簡體)": "zh",
-                            "英文": "en",
-                            "日文": "ja",
-                            "韓文": "ko",
-                            "其他": "custom"
-                        }
-                        
                         selected_lang = st.selectbox(
                             "選擇語言",
-                            options=list(languages.keys())
+                            options=TRANSCRIPTION_LANGUAGE_OPTIONS
                         )
                         
                         if selected_lang == "其他":
@@ -1270,7 +2398,7 @@ def main():
                             )
                             language_code = custom_lang if custom_lang else None
                         else:
-                            language_code = languages[selected_lang]
+                            language_code = TRANSCRIPTION_LANGUAGES[selected_lang]
                     else:
                         language_code = None
             
@@ -1303,10 +2431,7 @@ def main():
                     # 添加模型選擇選項
                     gemini_model = st.radio(
                         "選擇 Gemini 模型",
-                        options=[
-                            "gemini-2.5-pro-preview-05-06", 
-                            "gemini-2.5-flash-preview-04-17"
-                        ],
+                        options=GEMINI_MODELS,
                         index=0,
                         help="Pro 版本功能更強大，Flash 版本速度更快"
                     )
@@ -1457,257 +2582,96 @@ def main():
                 st.error("請提供 ElevenLabs API 金鑰")
                 return
             
+            # 相同音訊內容與設定直接使用快取的轉錄結果
+            transcription_cache = get_result_cache(
+                "transcription",
+                TRANSCRIPTION_CACHE_MAX_ENTRIES
+            )
+            cache_key = (
+                hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest(),
+                transcription_service,
+                st.session_state["openai_model"] if transcription_service == "OpenAI 2025 New" else whisper_model,
+                language_code,
+                st.session_state["transcription_prompt"],
+                st.session_state.get("output_format", "純文字")
+            )
+            cached_transcript = transcription_cache.get(cache_key)
+            if cached_transcript is not None:
+                logger.info("使用快取的轉錄結果")
+                st.session_state.transcribed_text = cached_transcript
+                st.session_state.transcription_job = None
+                st.rerun()
+            
             try:
-                with st.spinner("處理中..."):
-                    # 初始化變數
-                    full_transcript = ""
-                    
-                    # 初始化 OpenAI 客戶端（如果需要）
-                    if transcription_service == "OpenAI 2025 New":
-                        openai_client = OpenAI(api_key=openai_api_key)
-                    
-                    # 處理上傳的檔案
-                    suffix = os.path.splitext(uploaded_file.name)[1]
-                    with tempfile.NamedTemporaryFile(
-                        delete=False,
-                        suffix=suffix
-                    ) as temp_file:
-                        temp_file.write(uploaded_file.getvalue())
-                        temp_path = temp_file.name
-                    
-                    try:
-                        # 檢查音訊長度
-                        try:
-                            audio = AudioSegment.from_file(temp_path)
-                            duration_seconds = len(audio) / 1000
-                        except Exception as audio_error:
-                            # 如果無法使用 AudioSegment（通常是缺少 ffmpeg），直接處理整個檔案
-                            logger.warning(f"無法分析音訊長度（可能缺少 ffmpeg）: {audio_error}")
-                            st.warning("⚠️ 偵測到缺少 ffmpeg，將直接處理整個音訊檔案（可能較慢）")
-                            audio_segments = [temp_path]
-                            duration_seconds = 0  # 設為 0 以跳過分段邏輯
-                        
-                        if duration_seconds > 600:  # 如果音訊超過 10 分鐘
-                            st.info("音訊較長，將採用固定時間分段處理...")
-                            logger.info(
-                                "音訊檔案長度: %.2f 秒，開始固定時間分段處理",
-                                duration_seconds
-                            )
-                            
-                            # 設定分段參數
-                            MAX_SEGMENT_DURATION = 600  # 最大分段時長（秒）
-                            OVERLAP_DURATION = 30      # 重疊時長（秒）
-                            segments = []
-                            start_time = 0.0
-                            
-                            # 進行固定時間分段
-                            while start_time < duration_seconds:
-                                end_time = min(
-                                    start_time + MAX_SEGMENT_DURATION, 
-                                    duration_seconds
-                                )
-                                
-                                # 如果不是第一段，則從前一段結尾提前開始
-                                if start_time > 0:
-                                    segment_start = start_time - OVERLAP_DURATION
-                                else:
-                                    segment_start = start_time
-                                
-                                # 擷取音訊片段
-                                segment = audio[
-                                    int(segment_start * 1000):int(end_time * 1000)
-                                ]
-                                segment_path = f"{temp_path}_segment_{len(segments)}.mp3"
-                                segment.export(segment_path, format="mp3")
-                                logger.info(
-                                    "儲存分段 %d，時間範圍：%.2f - %.2f 秒",
-                                    len(segments) + 1,
-                                    segment_start,
-                                    end_time
-                                )
-                                segments.append(segment_path)
-                                
-                                # 更新開始時間
-                                start_time = end_time
-                            
-                            audio_segments = segments
-                            logger.info(
-                                "完成分段處理，共 %d 個分段",
-                                len(segments)
-                            )
-                        else:
-                            audio_segments = [temp_path]
-                            logger.info("音訊長度適中，不需分段處理")
-                        
-                        progress_bar = st.progress(0)
-                        segment_results = []
-                        
-                        for i, segment_path in enumerate(audio_segments):
-                            if transcription_service == "Whisper":
-                                result = transcribe_audio_whisper(
-                                    segment_path,
-                                    model_name=whisper_model,
-                                    language=language_code,
-                                    initial_prompt=st.session_state["transcription_prompt"]
-                                )
-                            elif transcription_service == "ElevenLabs":
-                                result = transcribe_audio_elevenlabs(
-                                    api_key=elevenlabs_api_key,
-                                    file_path=segment_path,
-                                    language_code="zho",  # 指定中文
-                                    diarize=False  # 取消啟用說話者辨識
-                                )
-                            elif transcription_service == "OpenAI 2025 New":
-                                MAX_RETRIES = 3
-                                retry_count = 0
-                                failed = True
-                                while retry_count < MAX_RETRIES:
-                                    try:
-                                        with open(segment_path, "rb") as audio_file:
-                                            # GPT-4o 模型只支援 text 和 json 格式
-                                            # 根據官方文件，gpt-4o-transcribe 只支援 json 和 text
-                                            selected_format = st.session_state.get("output_format", "純文字")
-                                            if selected_format == "SRT (含時間戳)":
-                                                api_format = "json"  # 使用 json 嘗試獲取時間信息
-                                            else:
-                                                api_format = "text"
-                                            
-                                            # 添加詳細的調試信息
-                                            logger.info(f"準備轉錄分段 {i+1}/{len(audio_segments)}")
-                                            logger.info(f"使用模型: {st.session_state['openai_model']}")
-                                            logger.info(f"API 格式: {api_format}")
-                                            logger.info(f"語言代碼: {language_code}")
-                                            
-                                            response = (
-                                                openai_client.audio
-                                                .transcriptions
-                                                .create(
-                                                    model=st.session_state["openai_model"],
-                                                    file=audio_file,
-                                                    language=language_code,
-                                                    response_format=api_format,
-                                                    prompt=st.session_state["transcription_prompt"],
-                                                    temperature=0.3
-                                                )
-                                            )
-                                            # 成功則添加結果
-                                            if api_format == "json":
-                                                # JSON 格式，儲存完整回應以供後續處理
-                                                segment_results.append(response)
-                                                logger.info(f"JSON 回應長度: {len(str(response))}")
-                                            else:
-                                                # TEXT 格式，使用 .text 屬性
-                                                text_result = response.text if hasattr(response, 'text') else str(response)
-                                                segment_results.append(text_result)
-                                                logger.info(f"文字結果長度: {len(text_result)}")
-                                                logger.info(f"文字結果預覽: {text_result[:100]}...")
-                                            logger.info(
-                                                "成功轉錄分段 %d/%d",
-                                                i + 1,
-                                                len(audio_segments)
-                                            )
-                                            failed = False
-                                            break
-                                    except Exception as e:
-                                        retry_count += 1
-                                        error_msg = str(e)
-                                        logger.error(f"OpenAI API 錯誤詳細信息: {error_msg}")
-                                        if retry_count < MAX_RETRIES:
-                                            logger.warning(
-                                                "處理分段 %d 失敗 (重試 %d/%d)：%s",
-                                                i + 1,
-                                                retry_count,
-                                                MAX_RETRIES,
-                                                error_msg
-                                            )
-                                            time.sleep(3)
-                                        else:
-                                            logger.error(
-                                                "處理分段 %d 最終失敗：%s",
-                                                i + 1,
-                                                error_msg
-                                            )
-                                            # 顯示錯誤給用戶
-                                            st.error(f"OpenAI API 錯誤: {error_msg}")
-                                if failed:
-                                    # 若全部嘗試都失敗，附加空字串，確保完整排序
-                                    segment_results.append("")
-                            
-                            # 更新進度
-                            progress = (i + 1) / len(audio_segments)
-                            progress_bar.progress(progress)
-                            
-                            # 清理臨時檔案
-                            try:
-                                if segment_path != temp_path:
-                                    os.remove(segment_path)
-                                    logger.info(
-                                        "已清理臨時檔案：%s",
-                                        segment_path
-                                    )
-                            except Exception as e:
-                                logger.error(
-                                    "清理臨時檔案失敗：%s",
-                                    str(e)
-                                )
-                        
-                        # 增加調試日誌
-                        logger.info(f"共處理 {len(segment_results)} 個分段結果")
-                        
-                        # 合併結果
-                        # 根據輸出格式處理結果
-                        selected_format = st.session_state.get("output_format", "純文字")
-                        
-                        if selected_format == "SRT (含時間戳)":
-                            # 使用 JSON 回應生成 SRT
-                            full_transcript = generate_srt_from_json(
-                                segment_results,
-                                segment_duration=600,
-                                overlap_duration=30
-                            )
-                        elif selected_format == "Markdown":
-                            # 從結果中提取文字內容
-                            text_parts = []
-                            for result in segment_results:
-                                if hasattr(result, 'text'):
-                                    text_parts.append(result.text)
-                                else:
-                                    text_parts.append(str(result))
-                            raw_text = " ".join(text_parts)
-                            full_transcript = f"# 語音轉錄結果\n\n{raw_text}\n"
-                        else:
-                            # 純文字格式，從結果中提取文字內容
-                            text_parts = []
-                            for result in segment_results:
-                                if hasattr(result, 'text'):
-                                    text_parts.append(result.text)
-                                else:
-                                    text_parts.append(str(result))
-                            full_transcript = " ".join(text_parts)
-                        
-                        # 添加調試日誌
-                        logger.info(f"轉錄結果長度: {len(full_transcript) if full_transcript else 0}")
-                        logger.info("完成所有分段的轉錄與合併")
-                    
-                    except Exception as e:
-                        st.error(f"處理失敗：{str(e)}")
-                        logger.error(f"處理失敗：{str(e)}")
-                        full_transcript = ""  # 確保異常時重置變數
-                    
-                    # 處理轉錄結果
-                    if full_transcript and full_transcript.strip():
-                        st.session_state.transcribed_text = full_transcript
-                        st.success("轉錄完成！")
-                        logger.info("轉錄結果已儲存至 session_state")
-                        st.rerun()  # 使用新的 rerun 方法
-                    else:
-                        st.error("轉錄失敗或結果為空")
-                        logger.error("轉錄失敗：結果為空或無效")
-                        
+                # 處理上傳的檔案
+                suffix = os.path.splitext(uploaded_file.name)[1]
+                with tempfile.NamedTemporaryFile(
+                    delete=False,
+                    suffix=suffix
+                ) as temp_file:
+                    temp_file.write(uploaded_file.getbuffer())
+                    temp_path = temp_file.name
+                
+                # 背景執行緒無法存取 session state，先在此讀取所有設定
+                settings = {
+                    "service": transcription_service,
+                    "openai_client": (
+                        get_openai_client(openai_api_key)
+                        if transcription_service == "OpenAI 2025 New" else None
+                    ),
+                    "elevenlabs_api_key": elevenlabs_api_key,
+                    "openai_model": st.session_state["openai_model"],
+                    "whisper_model": whisper_model,
+                    "language_code": language_code,
+                    "transcription_prompt": st.session_state["transcription_prompt"],
+                    "output_format": st.session_state.get("output_format", "純文字")
+                }
+                
+                # 在背景執行緒中轉錄，頁面可繼續操作
+                job = {
+                    "status": "running",
+                    "completed": 0,
+                    "total": 0,
+                    "messages": [],
+                    "result": None,
+                    "cache_key": cache_key
+                }
+                st.session_state.transcription_job = job
+                threading.Thread(
+                    target=run_transcription_job,
+                    args=(job, uploaded_file, temp_path, suffix, settings),
+                    daemon=True
+                ).start()
             except Exception as e:
                 st.error(f"處理失敗：{str(e)}")
                 logger.error(f"處理失敗：{str(e)}")
         
+        # 顯示背景轉錄進度與結果
+        job = st.session_state.get("transcription_job")
+        if job:
+            for level, message in list(job["messages"]):
+                getattr(st, level)(message)
+            
+            if job["status"] == "running":
+                total = job["total"]
+                st.progress(
+                    job["completed"] / total if total else 0.0,
+                    text=f"轉錄中... 已完成 {job['completed']}/{total or '?'} 個分段"
+                )
+            else:
+                st.session_state.transcription_job = None
+                if job["status"] == "done":
+                    # 儲存至快取，超過上限時淘汰最舊的項目
+                    get_result_cache(
+                        "transcription",
+                        TRANSCRIPTION_CACHE_MAX_ENTRIES
+                    ).set(job["cache_key"], job["result"])
+                    
+                    st.session_state.transcribed_text = job["result"]
+                    st.success("轉錄完成！")
+                    logger.info("轉錄結果已儲存至 session_state")
+                    st.rerun()  # 使用新的 rerun 方法
+        
         # 優化標籤頁 (Step 3)
         with main_tabs[2]:
             st.header("Step 3: 文字優化")
@@ -1719,12 +2683,13 @@ def main():
 
             # 顯示優化結果（如果有的話）
             if st.session_state.optimized_text:
+                session = st.session_state
                 st.subheader("優化結果")
                 
                 # 顯示優化結果
                 st.text_area(
                     "完整優化結果",
-                    st.session_state.full_result,
+                    session.full_result,
                     height=500
                 )
                 
@@ -1735,7 +2700,7 @@ def main():
                 with col1:
                     st.download_button(
                         label="📥 下載純文字格式",
-                        data=st.session_state.full_result,  # 已經是純文字格式，不需要額外處理
+                        data=session.full_result_bytes,  # 已經是純文字格式，不需要額外處理
                         file_name="optimized_result.txt",
                         mime="text/plain",
                         help="下載純文字格式的完整結果（包含優化結果和摘要）",
@@ -1746,7 +2711,7 @@ def main():
                 with col2:
                     st.download_button(
                         label="📥 下載 Markdown 格式",
-                        data=st.session_state.markdown_result,
+                        data=session.markdown_result_bytes,
                         file_name="optimized_result.md",
                         mime="text/markdown",
                         help="下載 Markdown 格式的完整結果（包含優化結果和摘要）",
@@ -1755,28 +2720,18 @@ def main():
                     )
                 
                 # 顯示費用統計（如果有的話）
-                optimization_service = st.session_state.get("optimization_service", "OpenAI")
+                optimization_service = session.get("optimization_service", "OpenAI")
+                st.markdown(f"總 Tokens: **{session.total_tokens:,}**")
                 if optimization_service == "OpenAI":
-                    tokens_display = st.session_state.total_tokens
-                    st.markdown(f"總 Tokens: **{tokens_display:,}**")
-                    
-                    # 計算費用
-                    cost_result = calculate_cost(
-                        st.session_state.input_tokens,
-                        st.session_state.output_tokens,
-                        st.session_state["optimization_model"],
-                        is_cached=False
+                    # 顯示詳細成本資訊，並重用同一份計算結果
+                    cost_result = display_cost_info(
+                        session.input_tokens,
+                        session.output_tokens,
+                        session["optimization_model"],
+                        cached_input_tokens=session.cached_input_tokens
                     )
                     
                     st.markdown(f"總費用: **NT$ {cost_result[1]:.2f}**")
-                    
-                    # 顯示詳細成本資訊
-                    display_cost_info(
-                        st.session_state.input_tokens,
-                        st.session_state.output_tokens,
-                        st.session_state["optimization_model"],
-                        is_cached=False
-                    )
                 else:
                     st.info("Gemini API 使用量暫不計費")
             else:
@@ -1804,12 +2759,13 @@ def main():
                                     st.error("請在側邊欄提供 OpenAI API 金鑰")
                                     return
                                     
-                                refined = refine_transcript(
-                                    raw_text=st.session_state.transcribed_text,
+                                refined = refine_transcript_openai(
+                                    text=st.session_state.transcribed_text,
                                     api_key=openai_api_key,
                                     model=st.session_state["optimization_model"],
                                     temperature=temperature,
-                                    context=st.session_state["optimization_prompt"]
+                                    context=st.session_state["optimization_prompt"],
+                                    placeholder=st.empty()
                                 )
                             else:  # Gemini
                                 if not gemini_api_key:
@@ -1820,7 +2776,8 @@ def main():
                                     text=st.session_state.transcribed_text,
                                     api_key=gemini_api_key,
                                     temperature=temperature,
-                                    context=st.session_state["optimization_prompt"]
+                                    context=st.session_state["optimization_prompt"],
+                                    placeholder=st.empty()
                                 )
                             
                             if refined:
@@ -1828,24 +2785,6 @@ def main():
                                 st.session_state.optimized_text = refined["corrected"]
                                 st.session_state.summary_text = refined["summary"]
                                 
-                                # 移除 Markdown 標記的函數
-                                def remove_markdown(text):
-                                    # 移除標題符號 (#)
-                                    text = text.replace('#', '')
-                                    # 移除粗體標記 (**)
-                                    text = text.replace('**', '')
-                                    # 移除斜體標記 (*)
-                                    text = text.replace('*', '')
-                                    # 移除分隔線 (---)
-                                    text = text.replace('---', '')
-                                    # 移除多餘的空行
-                                    text = "\n".join(
-                                        line.strip() 
-                                        for line in text.split("\n") 
-                                        if line.strip()
-                                    )
-                                    return text
-                                
                                 # 組合完整結果文字（純文字格式，移除所有 Markdown 標記）
                                 st.session_state.full_result = f"""優化後文字：
 {remove_markdown(refined["corrected"])}
@@ -1854,7 +2793,7 @@ def main():
 {remove_markdown(refined["summary"])}"""
 
                                 # Markdown 格式的結果（保留 Markdown 標記）
-                                st.session_state.markdown_result = f"""# 優化結果
+                                markdown_result = f"""# 優化結果
 
 ## 優化後文字
 {refined["corrected"]}
@@ -1862,12 +2801,25 @@ def main():
 ## 重點摘要
 {refined["summary"]}"""
                                 
+                                # 下載內容只編碼一次，避免每次重新執行都重新編碼
+                                st.session_state.full_result_bytes = (
+                                    st.session_state.full_result.encode("utf-8")
+                                )
+                                st.session_state.markdown_result_bytes = (
+                                    markdown_result.encode("utf-8")
+                                )
+                                
                                 # 更新 token 使用統計
                                 current_usage = refined.get("usage", {})
+                                # 未回報 usage 的呼叫已在 refine_transcript 中逐一估算
                                 st.session_state.input_tokens = current_usage.get(
                                     "total_input_tokens",
                                     0
                                 )
+                                st.session_state.cached_input_tokens = current_usage.get(
+                                    "total_cached_input_tokens",
+                                    0
+                                )
                                 st.session_state.output_tokens = current_usage.get(
                                     "total_output_tokens",
                                     0
@@ -1913,4 +2865,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
+    poll_transcription_job() 
\ No newline at end of file
@@ -6,7 +6,6 @@ import os
 import tempfile
 from pathlib import Path
 import logging
-from markitdown import MarkItDown
 from openai import OpenAI, AuthenticationError
 from typing import Dict, Any, Optional, List, Tuple
 import subprocess
@@ -96,6 +95,9 @@ def convert_file_to_markdown(input_path: str,
         
         # 使用原始 MarkItDown 進行轉換（適用於所有檔案類型）
         
+        # 延遲導入重量級套件，只在實際轉換時載入
+        from markitdown import MarkItDown
+        
         # 建立 MarkItDown 實例
         # 對於 PPTX 檔案或任何可能包含圖片的檔案，啟用所有插件
         md_kwargs = {"enable_plugins": True}
@@ -264,6 +266,9 @@ def convert_url_to_markdown(url: str) -> Tuple[bool, str, Dict[str, Any]]:
     try:
         logger.info(f"正在轉換 URL: {url}")
         
+        # 延遲導入重量級套件，只在實際轉換時載入
+        from markitdown import MarkItDown
+        
         # 建立 MarkItDown 實例
         md = MarkItDown(enable_plugins=True)
         
@@ -402,6 +407,9 @@ def convert_images_to_markdown(
         # 生成初始 Markdown 文本
         md_content = f"# {title}\n\n"
         
+        # 延遲導入重量級套件，只在實際轉換時載入
+        from markitdown import MarkItDown
+        
         # 建立 MarkItDown 實例
         md_kwargs = {"enable_plugins": True}
         llm_client = None
@@ -1,5 +1,8 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from openai import OpenAI
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import streamlit as st
 
 # 定義可用的 OpenAI 模型
@@ -10,12 +13,193 @@ OPENAI_MODELS = {
     "o3-mini": "o3-mini"
 }
 
+# 長文字分段修正時每段的最大字元數（中文約每字 1 token）
+REFINE_CHUNK_CHARS = 4000
+
+# 並行修正分段的最大執行緒數
+MAX_REFINE_WORKERS = 5
+
+# 分段時的句子：以句末標點、分號或換行結尾（英文句點與分號須後接空白或位於結尾，避免切開小數與縮寫），連同其後的空白
+SENTENCE_PATTERN = re.compile(r".*?(?:[。！？!?；\n]|[.;](?=\s|$))\s*|.+", re.S)
+
+# 單一句子過長時的次要斷點：空白或逗號
+SOFT_BREAK_PATTERN = re.compile(r"[\s，、,]")
+
+def _split_long_sentence(sentence: str, max_chars: int) -> List[str]:
+    """
+    將超過 max_chars 的單一句子切分，優先在最後一個空白或逗號之後切開，找不到時才依長度截斷
+    
+    Args:
+        sentence: 要切分的句子
+        max_chars: 每段的最大字元數
+    
+    Returns:
+        依原始順序排列的片段列表
+    """
+    pieces = []
+    while len(sentence) > max_chars:
+        breaks = [m.end() for m in SOFT_BREAK_PATTERN.finditer(sentence, 0, max_chars)]
+        cut = breaks[-1] if breaks else max_chars
+        pieces.append(sentence[:cut])
+        sentence = sentence[cut:]
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+def split_text_chunks(text: str, max_chars: int = REFINE_CHUNK_CHARS) -> List[str]:
+    """
+    在句子邊界將長文字切分為不超過 max_chars 字元的分段
+    
+    Args:
+        text: 要切分的文字
+        max_chars: 每段的最大字元數；單一句子超過時改在空白或逗號處切開
+    
+    Returns:
+        依原始順序排列的分段列表，串接後與原文相同
+    """
+    chunks = []
+    current = []
+    current_len = 0
+    for match in SENTENCE_PATTERN.finditer(text):
+        for piece in _split_long_sentence(match.group(), max_chars):
+            if current and current_len + len(piece) > max_chars:
+                chunks.append("".join(current))
+                current = []
+                current_len = 0
+            current.append(piece)
+            current_len += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks or [text]
+
+def join_corrected_chunks(parts: List[str], chunks: List[str]) -> str:
+    """
+    依序串接各分段的修正結果，並補回原始分段結尾的空白或換行（模型回應通常會去除）
+    
+    Args:
+        parts: 已完成的修正結果，可少於分段數
+        chunks: 原始分段
+    
+    Returns:
+        串接後的文字
+    """
+    return "".join(
+        part.rstrip() + chunk[len(chunk.rstrip()):]
+        for part, chunk in zip(parts, chunks)
+    )
+
+@lru_cache(maxsize=None)
+def get_token_encoder(model_name: str):
+    """
+    取得模型對應的 tiktoken 編碼器，tiktoken 無法辨識的模型使用 o200k_base
+    
+    Args:
+        model_name: 模型名稱
+    
+    Returns:
+        tiktoken.Encoding 編碼器
+    """
+    # 延遲導入，只有 API 未回報 token 數量時才需要載入
+    import tiktoken
+    
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens_batch(texts: List[str], model_name: str) -> List[int]:
+    """
+    以單次批次編碼計算多段文字的 token 數量
+    
+    Args:
+        texts: 要計算的文字列表
+        model_name: 模型名稱
+    
+    Returns:
+        各段文字的 token 數量
+    """
+    encoder = get_token_encoder(model_name)
+    return [len(tokens) for tokens in encoder.encode_batch([text or "" for text in texts])]
+
+def _sum_usage(calls: List[tuple], model: str) -> Dict[str, int]:
+    """
+    加總多次呼叫的 token 使用量；未回報 usage 的呼叫以本地編碼器估算其輸入與輸出
+    
+    Args:
+        calls: (usage 物件或 None, 該次呼叫的訊息列表, 回應文字) 的列表
+        model: 模型名稱，用於選擇編碼器
+    
+    Returns:
+        包含 input、output、cached_input 的 token 數量
+    """
+    totals = {"input": 0, "output": 0, "cached_input": 0}
+    missing = []
+    for usage, messages, output in calls:
+        if usage is None:
+            prompt = "\n".join(message["content"] for message in messages)
+            missing.extend([prompt, output])
+            continue
+        totals["input"] += getattr(usage, "prompt_tokens", 0) or 0
+        totals["output"] += getattr(usage, "completion_tokens", 0) or 0
+        totals["cached_input"] += _cached_tokens(usage)
+    
+    if missing:
+        try:
+            counts = count_tokens_batch(missing, model)
+            totals["input"] += sum(counts[0::2])
+            totals["output"] += sum(counts[1::2])
+        except Exception as e:
+            print(f"估算 token 數量失敗：{str(e)}")
+    return totals
+
+def _cached_tokens(usage: Any) -> int:
+    """
+    取得 usage 中命中提示快取的輸入 tokens 數量
+    
+    Args:
+        usage: Chat Completions 回應的 usage 物件，可能為 None
+    
+    Returns:
+        快取命中的 tokens 數量；未回報時為 0
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+def _stream_completion(client: OpenAI, params: Dict[str, Any], placeholder: Any):
+    """
+    以串流方式呼叫 Chat Completions，並將生成內容即時顯示在 placeholder 中
+    
+    Args:
+        client: OpenAI 客戶端
+        params: Chat Completions 參數
+        placeholder: Streamlit 的 st.empty() 元件
+    
+    Returns:
+        (完整回應文字, usage 物件；伺服器未回報時為 None)
+    """
+    stream = client.chat.completions.create(
+        **params,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    usage = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            placeholder.markdown("".join(parts))
+    return "".join(parts), usage
+
 def refine_transcript(
     raw_text: str,
     api_key: str,
     model: str = "o3-mini",
     temperature: float = 0.5,
-    context: Optional[str] = None
+    context: Optional[str] = None,
+    client: Optional[OpenAI] = None,
+    placeholder: Optional[Any] = None
 ) -> Optional[Dict[str, Any]]:
     """
     使用 OpenAI 優化轉錄文字
@@ -26,8 +210,23 @@ def refine_transcript(
         model: 使用的模型名稱
         temperature: 創意程度 (0.0-1.0)
         context: 背景資訊
+        client: 可重用的 OpenAI 客戶端，未提供時以 api_key 建立
+        placeholder: 提供 st.empty() 元件時，即時顯示修正後的文字
     """
-    client = OpenAI(api_key=api_key)
+    # 空白輸入不需呼叫 API
+    if not raw_text or not raw_text.strip():
+        return {
+            "corrected": raw_text,
+            "summary": "",
+            "usage": {
+                "total_input_tokens": 0,
+                "total_output_tokens": 0,
+                "model": model
+            }
+        }
+    
+    if client is None:
+        client = OpenAI(api_key=api_key)
     
     try:
         # 準備 API 參數
@@ -56,10 +255,45 @@ def refine_transcript(
         if model.startswith("gpt-4"):
             params["temperature"] = temperature
         
-        # 第一步：修正並轉換為繁體中文
-        correction_response = client.chat.completions.create(**params)
+        # 第一步：修正並轉換為繁體中文；長文字依句子邊界分段後並行修正，再依順序串接並保留原始分段間的空白
+        chunks = split_text_chunks(raw_text)
         
-        corrected_text = correction_response.choices[0].message.content
+        def correct_chunk(chunk: str):
+            messages = [
+                params["messages"][0],
+                {
+                    "role": "user",
+                    "content": f"請將以下文字轉換成繁體中文，並修正語法和標點符號：\n\n{chunk}"
+                }
+            ]
+            response = client.chat.completions.create(**dict(params, messages=messages))
+            return messages, response
+        
+        corrected_parts = []
+        # 每次呼叫的 (usage, 訊息, 回應文字)，用於加總或估算 token 使用量
+        calls = []
+        if len(chunks) == 1:
+            if placeholder is not None:
+                text, usage = _stream_completion(client, params, placeholder)
+            else:
+                response = client.chat.completions.create(**params)
+                text = response.choices[0].message.content or ""
+                usage = getattr(response, "usage", None)
+            corrected_parts.append(text)
+            calls.append((usage, params["messages"], text))
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(MAX_REFINE_WORKERS, len(chunks))
+            ) as executor:
+                # 依原始順序取回結果，每完成一段即更新顯示
+                for messages, response in executor.map(correct_chunk, chunks):
+                    text = response.choices[0].message.content or ""
+                    corrected_parts.append(text)
+                    calls.append((getattr(response, "usage", None), messages, text))
+                    if placeholder is not None:
+                        placeholder.markdown(join_corrected_chunks(corrected_parts, chunks))
+        
+        corrected_text = join_corrected_chunks(corrected_parts, chunks)
         
         # 第二步：結構化整理（使用相同的參數設定）
         params["messages"] = [
@@ -83,24 +317,21 @@ def refine_transcript(
         ]
         
         summary_response = client.chat.completions.create(**params)
-        summary_text = summary_response.choices[0].message.content
-        
-        # 計算總 token 使用量
-        total_input_tokens = (
-            correction_response.usage.prompt_tokens +
-            summary_response.usage.prompt_tokens
-        )
-        total_output_tokens = (
-            correction_response.usage.completion_tokens +
-            summary_response.usage.completion_tokens
+        summary_text = summary_response.choices[0].message.content or ""
+        calls.append(
+            (getattr(summary_response, "usage", None), params["messages"], summary_text)
         )
         
+        # 計算總 token 使用量；未回報 usage 的呼叫逐一估算，命中提示快取的輸入 tokens 以快取價格計費
+        totals = _sum_usage(calls, model)
+        
         return {
             "corrected": corrected_text,
             "summary": summary_text,
             "usage": {
-                "total_input_tokens": total_input_tokens,
-                "total_output_tokens": total_output_tokens,
+                "total_input_tokens": totals["input"],
+                "total_output_tokens": totals["output"],
+                "total_cached_input_tokens": totals["cached_input"],
                 "model": model
             }
         }